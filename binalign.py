@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+import numpy
+
+def place_rows(strlst, offsets, width, fill):
+    '''Copy every line into a width wide uint8 character matrix at its offset, one slice per row'''
+    charmat = numpy.full((len(strlst), width), ord(fill), dtype = numpy.uint8)
+    for currow, (curline, curoff) in enumerate(zip(strlst, offsets)):
+        curline = curline[:max(width - curoff, 0)]
+        charmat[currow, curoff:curoff + len(curline)] = numpy.frombuffer(curline.encode(), dtype = numpy.uint8)
+    return charmat
+
+def matrix_rows(charmat):
+    '''Turn a character matrix back into one string per row'''
+    text = charmat.tobytes().decode()
+    width = charmat.shape[1]
+    if not width:
+        return [""] * charmat.shape[0]
+    return [ text[x:x + width] for x in range(0, len(text), width) ]
+
+def xcorr_offsets(strlst, offsets, maxshift, rounds = 4):
+    '''Move every line by up to maxshift bits to best match the column majority of all lines'''
+    lengths = numpy.array([ len(x) for x in strlst ], dtype = numpy.int64)
+    offsets = numpy.asarray(offsets, dtype = numpy.int64)
+    #Try shifts closest to zero first so ties keep the current alignment
+    shifts = numpy.array(sorted(range(-maxshift, maxshift + 1), key = abs))
+    for curround in range(rounds):
+        offsets = offsets - offsets.min() + maxshift
+        width = int((offsets + lengths).max()) + maxshift
+        charmat = place_rows(strlst, offsets.tolist(), width, " ")
+        signs = (charmat == ord("1")).astype(numpy.float32) - (charmat == ord("0"))
+        #Weight columns by how strongly the lines agree, so constant sentinels outweigh varying data
+        consensus = numpy.zeros(width + 2 * maxshift, dtype = numpy.float32)
+        consensus[maxshift:maxshift + width] = signs.mean(axis = 0)
+        scores = numpy.stack([ signs @ consensus[maxshift + x:maxshift + x + width] for x in shifts.tolist() ], axis = 1)
+        moves = shifts[scores.argmax(axis = 1)]
+        if not moves.any():
+            break
+        offsets = offsets + moves
+    return (offsets - offsets.min()).tolist()
@@ -4,14 +4,31 @@ import argparse
 import sys
 import re
 import csv
+import itertools
+import os
+import subprocess
+import binext
+
+INVERTCHARS = str.maketrans("01", "10")
+
+try:
+    import numpy
+    import binalign
+    import binstat
+    import bincheck
+except ImportError:
+    numpy = None
 
 def validate_params(ags):
-    bindatlst = ags.file.read()
-    if re.search("[^01\n]", bindatlst):
-        print("Invalid character in input file")
-        sys.exit(0)
-    ags.file.seek(0)
-    if not ags.extended and (ags.extended_filter or ags.extended_sort):
+    if ags.out_of_core:
+        validate_out_of_core(ags)
+    else:
+        bindatlst = ags.file.read()
+        if re.search("[^01\n]", bindatlst):
+            print("Invalid character in input file")
+            sys.exit(0)
+        ags.file.seek(0)
+    if not ags.extended and (ags.extended_filter or ags.extended_query or ags.extended_sort):
         print("Filter input file required")
         sys.exit(1)
     if ags.split:
@@ -21,41 +38,83 @@ def validate_params(ags):
     if ags.repeat and not ags.split:
         print("Split list not specified")
         sys.exit(3)
+    if ags.align_pattern is not None and not re.match("^[01]+$", ags.align_pattern):
+        print("Invalid alignment pattern")
+        sys.exit(17)
+    if min(ags.add_start, ags.add_end, ags.remove_start, ags.remove_end, ags.align_xcorr) < 0:
+        print("Padding, trimming and shift counts must not be negative")
+        sys.exit(18)
+    if ags.align_xcorr and numpy is None:
+        print("Cross-correlation alignment requires numpy")
+        sys.exit(13)
+    if ags.analyse and numpy is None:
+        print("Field analysis requires numpy")
+        sys.exit(13)
+    if (ags.xor_search or ags.xor_check or ags.xor_list) and not ags.split:
+        print("Split list not specified")
+        sys.exit(3)
+    if (ags.xor_search or ags.xor_check) and numpy is None:
+        print("Checksum search and checks require numpy")
+        sys.exit(13)
+    if ags.xor_list and not ags.xor_search:
+        print("Token list requires checksum search")
+        sys.exit(14)
+    if ags.xor_remove and not ags.xor_check:
+        print("Checksum removal requires checksum check")
+        sys.exit(14)
+
+def validate_out_of_core(ags):
+    if not ags.file.seekable() or (ags.extended and not ags.extended.seekable()):
+        print("Out of core mode requires seekable input files")
+        sys.exit(10)
+    if ags.analyse or ags.xor_search or ags.xor_check or ags.align_xcorr:
+        print("Field analysis, checksums and cross-correlation alignment are not supported in out of core mode")
+        sys.exit(11)
+    if ags.extended_sort or ags.extended_query:
+        print("Queries and sorting are not supported in out of core mode, use -ef")
+        sys.exit(11)
     
 def align_and_padd(ags, strlst):
-    if ags.no_align == False:
-        indlst = [ x.find("0" if ags.padding else "1") for x in strlst ]
-        maxlst = max(indlst)
-        for strind in range(len(strlst)):
-            strlst[strind] = (("1" if ags.padding else "0") * (maxlst - indlst[strind])) + strlst[strind]
-    indlen = [ len(x) for x in strlst ]
-    for strind in range(len(strlst)):
-        strlst[strind] = strlst[strind].ljust(max(indlen), "1" if ags.padding else "0")
-        if ags.add_start:
-            strlst[strind] = (("1" if ags.padding else "0") * ags.add_start) + strlst[strind]
-        if ags.add_end:
-            strlst[strind] = strlst[strind] + (("1" if ags.padding else "0") * ags.add_end)
-        if ags.remove_start:
-            strlst[strind] = strlst[strind][ags.remove_start:]
-        if ags.remove_end:
-            strlst[strind] = strlst[strind][:-ags.remove_end]
+    '''Place every line at its alignment offset, then pad, trim and invert it in one slice'''
+    anchors = [ line_anchor(ags, x) for x in strlst ]
+    maxanchor = max(anchors)
+    offsets = [ maxanchor - x for x in anchors ]
+    if ags.align_xcorr:
+        offsets = binalign.xcorr_offsets(strlst, offsets, ags.align_xcorr)
+    width = max([ x + len(y) for x, y in zip(offsets, strlst) ])
+    rowend = max(ags.add_start + width + ags.add_end - ags.remove_end, 0)
+    if numpy is None:
+        return [ align_line(ags, x, ags.add_start + y, rowend) for x, y in zip(strlst, offsets) ]
+    charmat = binalign.place_rows(strlst, [ ags.add_start + x for x in offsets ], rowend, "1" if ags.padding else "0")
+    charmat = charmat[:, ags.remove_start:]
     if ags.invert_after:
-        strlst = invert_bits(strlst)
-    return strlst
-
-def invert_bits(strlst):
-    newlst = []
-    for cline in strlst:
-        tmp = list(cline)
-        for curchar in range(len(tmp)):
-            if tmp[curchar] == "0":
-                tmp[curchar] = "1"
-            else:
-                tmp[curchar] = "0"
-        newlst += [''.join(tmp)]
-    return newlst
+        charmat ^= 1
+    return binalign.matrix_rows(charmat)
+
+def line_anchor(ags, curline):
+    '''Position of the alignment pattern, or of the first non padding bit, 0 when not aligning'''
+    if ags.no_align:
+        return 0
+    #-1 when absent, so as before such lines are shifted one bit past the furthest anchor
+    return curline.find(ags.align_pattern or ("0" if ags.padding else "1"))
+
+def align_line(ags, curline, shift, rowend):
+    '''Pad, trim and invert one line with a single slice'''
+    padchar = "1" if ags.padding else "0"
+    curline = (padchar * shift + curline + padchar * (rowend - shift - len(curline)))[ags.remove_start:rowend]
+    return curline.translate(INVERTCHARS) if ags.invert_after else curline
+
+def bit_matrix(bindatlst):
+    '''Load equal length bitstrings into a uint8 matrix with one row per line'''
+    bitmat = numpy.frombuffer("".join(bindatlst).encode(), dtype = numpy.uint8).reshape(len(bindatlst), len(bindatlst[0]))
+    return bitmat - ord("0")
 
 def calc_weight(ags, bindatlst):
+    if numpy is not None:
+        return calc_weight_numpy(ags, bindatlst)
+    return calc_weight_list(ags, bindatlst)
+
+def calc_weight_list(ags, bindatlst):
     colweight = []
     for curcol in range(len(bindatlst[0])):
         wcount = {"0":0, "1":0}
@@ -70,27 +129,59 @@ def calc_weight(ags, bindatlst):
         colweight += [wcount]
     return colweight
 
+def calc_weight_numpy(ags, bindatlst):
+    '''Count ones per column of the bit matrix and derive the zero count, weight and minority character from it'''
+    ones = bit_matrix(bindatlst).sum(axis = 0, dtype = numpy.int64)
+    zeros = len(bindatlst) - ones
+    minzero = zeros < ones
+    weights = numpy.where(minzero, zeros, ones)
+    return [ {"0": x, "1": y, "CW": z, "CC": "0" if w else "1"}
+             for x, y, z, w in zip(zeros.tolist(), ones.tolist(), weights.tolist(), minzero.tolist()) ]
+
 def print_res(ags, bindatlst, colweight, splits):
+    rows = render_rows(bindatlst, render_layout(ags, colweight, splits))
+    if ags.pager:
+        pagerproc = subprocess.Popen(os.environ.get("PAGER", "less -R"), shell=True, stdin=subprocess.PIPE, text=True)
+        try:
+            write_rows(pagerproc.stdin, rows, 1024)
+            pagerproc.stdin.close()
+        except BrokenPipeError:
+            pass
+        pagerproc.wait()
+    elif ags.stream or ags.out_of_core:
+        write_rows(sys.stdout, rows, 1024)
+    else:
+        sys.stdout.write("".join(rows))
+
+def render_layout(ags, colweight, splits):
+    '''Group the columns into runs sharing one color and no split, as (start, end, prefix, suffix) tuples'''
     NC='\033[0m'
     COL='\033[0;34m'
-    if ags.split:
-        splitpos = [splits[0]]
-        for cursplit in range(1, len(splits)):
-            splitpos += [splitpos[cursplit-1] + splits[cursplit]]
-    for currow in range(len(bindatlst)):
-        for curcol in range(len(bindatlst[0])):
-            if ags.split and curcol in splitpos:
-                print(" ", end="")
-            if colweight[curcol]["CW"]:
-                if ags.no_color:
-                    print(bindatlst[currow][curcol], end="")
-                else:
-                    print(COL + bindatlst[currow][curcol] + NC, end="")
-            else:
-                print(bindatlst[currow][curcol], end="")
-        print()
+    splitpos = set(itertools.accumulate(splits)) if ags.split else set()
+    colored = [ bool(x["CW"]) and not ags.no_color for x in colweight ]
+    layout = []
+    runstart = 0
+    for curcol in range(1, len(colweight) + 1):
+        if curcol == len(colweight) or curcol in splitpos or colored[curcol] != colored[runstart]:
+            prefix = (" " if runstart in splitpos else "") + (COL if colored[runstart] else "")
+            layout += [(runstart, curcol, prefix, NC if colored[runstart] else "")]
+            runstart = curcol
+    return layout
+
+def render_rows(bindatlst, layout):
+    for curline in bindatlst:
+        yield "".join([ x[2] + curline[x[0]:x[1]] + x[3] for x in layout ]) + "\n"
+
+def write_rows(outh, rows, chunksize):
+    '''Write rows in chunks, flushing each one so output starts before the last row is rendered'''
+    while True:
+        chunk = "".join(itertools.islice(rows, chunksize))
+        if not chunk:
+            break
+        outh.write(chunk)
+        outh.flush()
         
-def format_splits(ags, bindatlst):
+def format_splits(ags, maxlen):
     if not ags.split:
         return None
     splits = ags.split.split(",")
@@ -100,7 +191,6 @@ def format_splits(ags, bindatlst):
             sys.exit(4)
     splits = [ int(x) for x in splits ]
     splitsm = []
-    maxlen = len(bindatlst[0])
     curlen = 0
     cursplit = 0
     while (curlen+splits[cursplit]) < maxlen:
@@ -116,7 +206,7 @@ def format_splits(ags, bindatlst):
         sys.exit(5)
     return splitsm
 
-def csv_filter(ags):
+def csv_filter(ags, bindatlst):
     if not ags.extended:
         return None
     extin = [ x for x in list(csv.reader(ags.extended)) if len(x) ]
@@ -127,59 +217,259 @@ def csv_filter(ags):
     if len(fcount) != 1:
         print("Fields missing in extended input")
         sys.exit(7)
-    return extin
+    return binext.BinExtTable(extin[0], extin[1:])
     
-def apply_filter(ags, bindatlst, fltdat):
-    if not ags.extended_filter:
-        return fltdat, bindatlst
+def apply_filter(ags, fltdat):
+    '''Return the indexes of the lines matching every -eq condition and the -ef field value'''
+    if fltdat is None:
+        return None
     try:
-        valind = fltdat[0].index(ags.extended_filter[0])
-    except ValueError:
+        conditions = [ binext.BinExtTable.parse_condition(x) for x in ags.extended_query ]
+        rowinds = fltdat.select(conditions)
+        #-ef matches the CSV text exactly like the out of core filter does, typed comparisons are left to -eq
+        if ags.extended_filter:
+            rowinds = sorted(fltdat.match_text(*ags.extended_filter).intersection(rowinds))
+    except KeyError:
         print("Filter paramter not listed")
         sys.exit(8)
-    newbindatlst = []
-    newfltdat = [fltdat[0]] 
-    for curline in range(len(bindatlst)):
-        if fltdat[curline+1][valind] == ags.extended_filter[1]:
-            newbindatlst += [bindatlst[curline]]
-            newfltdat += [fltdat[curline+1]]
-    if not newbindatlst:
+    except ValueError as e:
+        print(str(e))
+        sys.exit(12)
+    if not rowinds:
         print("Filter yielded empty list")
         sys.exit(9)
-    return newfltdat, newbindatlst
+    return rowinds
 
-def sort_filter(ags, bindatlst, fltdat):
+def sort_filter(ags, fltdat, rowinds):
     if not ags.extended_sort:
-        return bindatlst
+        return rowinds
     try:
-        valind = fltdat[0].index(ags.extended_sort)
-    except ValueError:
+        return fltdat.order(rowinds, ags.extended_sort.split(","))
+    except KeyError:
         print("Sort paramter not listed")
         sys.exit(8)
-    #print("Sort filter index: " + str(valind) + " - " + fltdat[0][valind])
-    #print(fltdat)
-    cvals = [ x[valind] for x in fltdat ]
-    del cvals[0]
-    cvals, newbindatlst = zip(*sorted(zip(cvals, bindatlst)))
-    #print(cvals)
+
+def print_analysis(ags, bindatlst, colweight, splits, fltdat, rowinds):
+    '''Print the entropy of every column under the output, then proposed fields, correlated bits and attribute encodings'''
+    bitmat = bit_matrix(bindatlst)
+    entropy = binstat.bit_entropy(bitmat)
+    entrow = "".join([ str(x) for x in numpy.rint(entropy * 9).astype(int).tolist() ])
+    print("".join(render_rows([entrow], render_layout(ags, colweight, splits))), end="")
+    fields = binstat.field_boundaries(entropy)
+    print("Varying fields: " + ", ".join([ str(x[0]) + "-" + str(x[0] + x[1] - 1) for x in fields if x[2] ]))
+    print("Suggested split: -s " + ",".join([ str(x[1]) for x in fields ]))
+    period = binstat.symbol_period(entropy)
+    if period:
+        print("Symbol period: {} bits (r={:.2f}), try -s {} -r".format(period[0], period[1], period[0]))
+    for first, second, corr in binstat.correlated_pairs(binstat.bit_correlation(bitmat)):
+        print("Bits {} and {}: r={:+.2f}".format(first, second, corr))
+    if fltdat is None:
+        return
+    for field in fltdat.get_fields():
+        if fltdat.get_type(field) is str:
+            continue
+        column = fltdat.get_column(field)
+        values = numpy.array([ numpy.nan if column[x] is None else column[x] for x in rowinds ], dtype = numpy.float64)
+        if numpy.all(numpy.isnan(values)) or numpy.nanmin(values) == numpy.nanmax(values):
+            continue
+        encodings = binstat.find_encodings(bitmat, values)
+        for start, width, order, offset in encodings:
+            print("{}: bits {}-{} {} first, offset {:+d}".format(field, start, start + width - 1, order, offset))
+        if encodings:
+            continue
+        attcorr = numpy.nan_to_num(binstat.attribute_correlation(bitmat, values))
+        strongest = numpy.argsort(-numpy.abs(attcorr), kind = "stable")[:3].tolist()
+        print(field + ": strongest bits " + ", ".join([ "{} (r={:+.2f})".format(x, attcorr[x]) for x in strongest ]))
+
+def parse_tokens(ags, tokstr, bounds):
+    if re.search("[^0-9,]", tokstr) or "" in tokstr.split(","):
+        print("Invalid token list")
+        sys.exit(15)
+    tokens = [ int(x) for x in tokstr.split(",") ]
+    if max(tokens) >= len(bounds):
+        print("Token number out of range, the split gives " + str(len(bounds)) + " tokens")
+        sys.exit(15)
+    return tokens
+
+def xor_filter(ags, bindatlst, splits):
+    '''Check the -xc XOR on every line against the most common initial value, printing the result or dropping failing lines'''
+    if not ags.xor_check:
+        return bindatlst
+    bounds = bincheck.token_bounds(splits, len(bindatlst[0]))
+    tokens = parse_tokens(ags, ags.xor_check[0], bounds)
+    check = parse_tokens(ags, ags.xor_check[1], bounds)[0]
+    columns = bincheck.token_columns(bit_matrix(bindatlst), bounds)
+    if any(columns[x] is None for x in tokens + [check]):
+        print("Tokens over 62 bits can not be checked")
+        sys.exit(15)
+    residue = bincheck.check_residue("xor", columns, tokens, check, 1 << bounds[check][1])
+    values, counts = numpy.unique(residue, return_counts = True)
+    passed = residue == values[counts.argmax()]
+    if not ags.xor_remove:
+        print("XOR check init {:#x}: {} of {} lines pass".format(int(values[counts.argmax()]), int(passed.sum()), len(bindatlst)))
+        return bindatlst
+    newbindatlst = [ x for x, y in zip(bindatlst, passed.tolist()) if y ]
+    if not newbindatlst:
+        print("XOR check yielded empty list")
+        sys.exit(9)
     return newbindatlst
 
+def print_checks(ags, bindatlst, splits):
+    '''Print the XOR, sum and LRC checks found to hold on every line for the split layout'''
+    bounds = bincheck.token_bounds(splits, len(bindatlst[0]))
+    tokens = parse_tokens(ags, ags.xor_list, bounds) if ags.xor_list else None
+    columns = bincheck.token_columns(bit_matrix(bindatlst), bounds)
+    found = set()
+    try:
+        for check, op, soltokens, init, aliases in bincheck.search_checks(columns, bounds, tokens, workers = ags.jobs):
+            #An XOR relation holds for every token in it, print it once under its lowest token
+            relation = (op, frozenset([check] + soltokens) if op == "xor" else (check, tuple(soltokens)), init)
+            if relation in found:
+                continue
+            found.add(relation)
+            duplicates = " (={})".format("=".join([ str(x) for x in aliases[check] ])) if aliases[check] else ""
+            print("Token {}{} = {} {} init {:#x}".format(check, duplicates, op, ",".join([ str(x) for x in soltokens ]), init))
+    except ValueError as e:
+        print(str(e) + ", restrict the tokens with -xl")
+        sys.exit(16)
+    if not found:
+        print("No checksum found")
+
+def stream_lines(ags):
+    '''Yield every bitstring of the input file one at a time with whether the extended filter keeps it'''
+    ags.file.seek(0)
+    if not ags.extended_filter:
+        for curline in ags.file:
+            curline = curline.strip()
+            if curline:
+                yield curline, True
+        return
+    ags.extended.seek(0)
+    extrows = ( x for x in csv.reader(ags.extended) if len(x) )
+    fields = next(extrows, [])
+    try:
+        valind = fields.index(ags.extended_filter[0])
+    except ValueError:
+        print("Filter paramter not listed")
+        sys.exit(8)
+    for curline in ags.file:
+        curline = curline.strip()
+        if not curline:
+            continue
+        curext = next(extrows, None)
+        if curext is None:
+            print("Extended input file length mismatch")
+            sys.exit(6)
+        if len(curext) != len(fields):
+            print("Fields missing in extended input")
+            sys.exit(7)
+        yield curline, curext[valind] == ags.extended_filter[1]
+    if next(extrows, None) is not None:
+        print("Extended input file length mismatch")
+        sys.exit(6)
+
+def stream_scan(ags, blocksize = 4096):
+    '''First pass: check every line and find the longest line per alignment anchor, then count lines and ones per
+    position of the lines the filter keeps, grouped by anchor so no line is kept past its block'''
+    extents = {}
+    anchors = {}
+    blocks = {}
+    buffered = 0
+    linecount = 0
+    for curline, keep in stream_lines(ags):
+        if re.search("[^01]", curline):
+            print("Invalid character in input file")
+            sys.exit(0)
+        curind = line_anchor(ags, curline)
+        #Like the in memory path, alignment and width come from all lines before filtering
+        extents[curind] = max(extents.get(curind, 0), len(curline))
+        if not keep:
+            continue
+        curanchor = anchors.setdefault(curind, {"ones": [], "lengths": {}})
+        curanchor["lengths"][len(curline)] = curanchor["lengths"].get(len(curline), 0) + 1
+        blocks.setdefault(curind, []).append(curline)
+        buffered += 1
+        linecount += 1
+        if buffered == blocksize:
+            scan_blocks(ags, anchors, blocks)
+            buffered = 0
+    scan_blocks(ags, anchors, blocks)
+    if not extents:
+        print("Input file is empty")
+        sys.exit(9)
+    if not linecount:
+        print("Filter yielded empty list")
+        sys.exit(9)
+    return linecount, extents, anchors
+
+def scan_blocks(ags, anchors, blocks):
+    for curind, curblock in blocks.items():
+        blocklen = max([ len(x) for x in curblock ])
+        ones = [ x["1"] for x in calc_weight(ags, [ x.ljust(blocklen, "0") for x in curblock ]) ]
+        curones = anchors[curind]["ones"]
+        curones += [0] * (blocklen - len(curones))
+        for curcol in range(blocklen):
+            curones[curcol] += ones[curcol]
+    blocks.clear()
+
+def stream_layout(ags, extents):
+    '''Return the common anchor position and the aligned line width before padding is added or removed'''
+    maxind = max(extents)
+    return maxind, max([ maxind - x + y for x, y in extents.items() ])
+
+def stream_weights(ags, linecount, extents, anchors):
+    '''Shift the per anchor counts into aligned columns and account for padding, trimming and inversion'''
+    maxind, width = stream_layout(ags, extents)
+    ones = [0] * width
+    cover = [0] * (width + 1)
+    for curind, curanchor in anchors.items():
+        shift = maxind - curind
+        for curcol in range(len(curanchor["ones"])):
+            ones[shift + curcol] += curanchor["ones"][curcol]
+        for curlen, curcount in curanchor["lengths"].items():
+            cover[shift] += curcount
+            cover[shift + curlen] -= curcount
+    padones = linecount if ags.padding else 0
+    if ags.padding:
+        ones = [ x + linecount - y for x, y in zip(ones, itertools.accumulate(cover)) ]
+    ones = [padones] * ags.add_start + ones + [padones] * ags.add_end
+    ones = ones[ags.remove_start:len(ones) - ags.remove_end]
+    if ags.invert_after:
+        ones = [ linecount - x for x in ones ]
+    return [ {"0": linecount - x, "1": x, "CW": min(x, linecount - x), "CC": "0" if linecount - x < x else "1"} for x in ones ]
+
+def stream_aligned(ags, extents):
+    '''Second pass: yield every line the filter keeps aligned, padded and trimmed in one slice'''
+    maxind, width = stream_layout(ags, extents)
+    rowend = max(ags.add_start + width + ags.add_end - ags.remove_end, 0)
+    for curline, keep in stream_lines(ags):
+        if keep:
+            yield align_line(ags, curline, ags.add_start + maxind - line_anchor(ags, curline), rowend)
+
 if __name__ == '__main__':
 
     agp = argparse.ArgumentParser()
     agp.add_argument("-f", "--file", help="Input file for binary strings", required=True, type=argparse.FileType('r'))
     agp.add_argument("-d", "--no-align", help="Do not auto align strings", action='store_true')
+    agp.add_argument("-ap", "--align-pattern", help="Align strings on the first occurrence of a bit pattern, such as the P1 start sentinel 11111110", type=str)
+    agp.add_argument("-ax", "--align-xcorr", help="After aligning, move each string by up to n bits to best match the column majority (requires numpy)", type=int, default=0)
     agp.add_argument("-p", "--padding", help="Padd with 1 instead of 0", action='store_true')
     agp.add_argument("-s", "--split", help="Comma seperated list of token bit lengths", type=str)
     agp.add_argument("-r", "--repeat", help="Repeat the token sequence given by -s (requires -s)", action='store_true')
     #agp.add_argument("-tm", "--token-match", help="Match all lines that have n in the specified token field (requires -s)", nargs=2, type=str)
-    #agp.add_argument("-xl", "--xor-list", help="Comma seperated list of tokens to use in XOR check", type=str)
-    #agp.add_argument("-xc", "--xor-check", help="Comma seperated list of tokens to check, followed by a token number for xor field", nargs=2, type=str)
-    #agp.add_argument("-xr", "--xor-remove", help="Remove all lines that fail xor check (requires -xc)", action='store_true')
+    agp.add_argument("-xs", "--xor-search", help="Search for XOR, sum and LRC checks between tokens that hold on every line, "
+                                                 "tokens are numbered from 0 (requires -s and numpy)", action='store_true')
+    agp.add_argument("-xl", "--xor-list", help="Comma seperated list of tokens to use in checksum search (requires -xs)", type=str)
+    agp.add_argument("-xc", "--xor-check", help="Comma seperated list of tokens to check, followed by a token number for xor field (requires -s and numpy)", nargs=2, type=str)
+    agp.add_argument("-xr", "--xor-remove", help="Remove all lines that fail xor check (requires -xc)", action='store_true')
+    agp.add_argument("-j", "--jobs", help="Number of worker processes for checksum search, 0 searches in process", type=int, default=0)
     agp.add_argument("-nc", "--no-color", help="Don't print changing columns in color", action='store_true')
     agp.add_argument("-e", "--extended", help="Path to a CSV file with extended attributes", type=argparse.FileType('r'))
-    agp.add_argument("-ef", "--extended-filter", help="Filter lines by field values specified in CSV file (requires -e)", nargs=2, type=str)
-    agp.add_argument("-es", "--extended-sort", help="Sort lines by field values specified in CSV file (requires -e)", type=str)
+    agp.add_argument("-ef", "--extended-filter", help="Filter lines by the exact CSV text of a field value (requires -e)", nargs=2, type=str)
+    agp.add_argument("-eq", "--extended-query", help="Filter lines by a FIELD<op>VALUE condition on the CSV file, op is one of == != < <= > >=, "
+                                                      "numeric fields compare as numbers, may be repeated (requires -e)", action='append', default=[])
+    agp.add_argument("-es", "--extended-sort", help="Sort lines by a comma seperated list of fields specified in CSV file, "
+                                                     "prefix a field with - to sort descending, as in -es=-PRICE,FHOUR (requires -e)", type=str)
     #agp.add_argument("-ep", "--extended-print", help="For each line print the field value specified in the CSV file (requires -e)", type=str)
     agp_mx1 = agp.add_mutually_exclusive_group()
     agp_mx1.add_argument("-ae", "--add-end", help="Number of padding bits to add to the end of each line", type=int, default=0)
@@ -190,6 +480,12 @@ if __name__ == '__main__':
     #agp_mx3 = agp.add_mutually_exclusive_group()
     #agp_mx3.add_argument("-m", "--min-count", help="Highlight rows where the weight for any given changing column is n or less", type=int, default=0)
     #agp_mx3.add_argument("-mr", "--min-remove", help="Remove rows where the weight for any given changing column is n or less", type=int, default=0)
+    agp.add_argument("-a", "--analyse", help="After the output print column entropy, proposed fields, correlated bits and "
+                                            "encodings of numeric extended fields (requires numpy)", action='store_true')
+    agp.add_argument("-oc", "--out-of-core", help="Read the input twice instead of holding it in memory, implies -st unless -pg is given", action='store_true')
+    agp_mx5 = agp.add_mutually_exclusive_group()
+    agp_mx5.add_argument("-st", "--stream", help="Write output in chunks as it is rendered", action='store_true')
+    agp_mx5.add_argument("-pg", "--pager", help="Stream output into $PAGER, defaults to less -R", action='store_true')
     agp_mx4 = agp.add_mutually_exclusive_group()
     #agp_mx4.add_argument("-ib", "--invert-before", help="Invert all bits before alignment", action='store_true')
     agp_mx4.add_argument("-ia", "--invert-after", help="Invert all bits after alignment", action='store_true')
@@ -214,16 +510,26 @@ if __name__ == '__main__':
     ags = agp.parse_args()
 
     validate_params(ags)
+    if ags.out_of_core:
+        linecount, extents, anchors = stream_scan(ags)
+        colweight = stream_weights(ags, linecount, extents, anchors)
+        splits = format_splits(ags, len(colweight))
+        print_res(ags, stream_aligned(ags, extents), colweight, splits)
+        sys.exit(0)
     bindatlst = ags.file.read().split()
     bindatlst = align_and_padd(ags, bindatlst)
-    splits = format_splits(ags, bindatlst)
-    fltdat = csv_filter(ags)
-    fltdat, bindatlst = apply_filter(ags, bindatlst, fltdat)
-    bindatlst = sort_filter(ags, bindatlst, fltdat)
-    #bindatlst = xor_filter(ags, bindatlst)
-    colweight = calc_weight(ags, bindatlst)
+    splits = format_splits(ags, len(bindatlst[0]))
+    fltdat = csv_filter(ags, bindatlst)
+    rowinds = sort_filter(ags, fltdat, apply_filter(ags, fltdat))
+    if rowinds is not None:
+        bindatlst = [ bindatlst[x] for x in rowinds ]
+    bindatlst = xor_filter(ags, bindatlst, splits)
     #bindatlst = weight_filter(ags, bindatlst)
     colweight = calc_weight(ags, bindatlst)
     print_res(ags, bindatlst, colweight, splits)
+    if ags.analyse:
+        print_analysis(ags, bindatlst, colweight, splits, fltdat, rowinds)
+    if ags.xor_search:
+        print_checks(ags, bindatlst, splits)
 
 # CNUM,GNUM,ENTH,ENTM,PAYH,PAYM
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import concurrent.futures
+import itertools
+import numpy
+
+CHECK_OPS = ("xor", "sum", "lrc")
+MAXCANDIDATES = 40
+
+def token_bounds(splits, width):
+    '''Return (start, width) of every token, the bits after the last split forming the final token'''
+    starts = [0] + list(itertools.accumulate(splits))
+    return [ (x, y - x) for x, y in zip(starts, starts[1:] + [width]) if y > x ]
+
+def token_columns(bitmat, bounds):
+    '''Pack every token of every row into an integer column, first bit most significant, None for tokens over 62 bits'''
+    columns = []
+    for start, width in bounds:
+        if width > 62:
+            columns += [None]
+            continue
+        weights = numpy.left_shift(1, numpy.arange(width - 1, -1, -1, dtype = numpy.int64))
+        columns += [bitmat[:, start:start + width].astype(numpy.int64) @ weights]
+    return columns
+
+def _combine(op, acc, values, modulus):
+    return acc ^ values if op == "xor" else (acc + values) % modulus
+
+def _residue(op, check, combined, modulus):
+    '''Value that must be equal on every row for the check to hold, it is the initial value of the checksum'''
+    if op == "xor":
+        return check ^ combined
+    if op == "sum":
+        return (check - combined) % modulus
+    return (check + combined) % modulus
+
+def check_residue(op, columns, tokens, check, modulus):
+    '''Residue of a checksum over the given tokens on every row'''
+    combined = numpy.zeros(len(columns[check]), dtype = numpy.int64)
+    for curtok in tokens:
+        combined = _combine(op, combined, columns[curtok] % modulus if op != "xor" else columns[curtok] & (modulus - 1), modulus)
+    return _residue(op, columns[check], combined, modulus)
+
+def _subset_table(op, sigs, modulus):
+    '''Combine every subset of the signature rows, row i of the result belongs to the subset with bitmask i'''
+    table = numpy.zeros((1, sigs.shape[1]), dtype = numpy.int64)
+    for cursig in sigs:
+        table = numpy.concatenate((table, _combine(op, table, cursig, modulus)))
+    return table
+
+def solve_check(op, columns, candidates, check, modulus, samplesize = 16, limit = 8, maxjoins = 65536):
+    '''Return up to limit (tokens, initial value) pairs whose checksum into the check token holds on every row, fewest tokens first'''
+    if len(candidates) > MAXCANDIDATES:
+        raise ValueError("Too many varying tokens to search: " + str(len(candidates)))
+    #Meet in the middle on row differences against a sample row, which cancel the initial value:
+    #both halves of the candidates are tabulated once, joined through a hash and verified on all rows
+    sample = numpy.unique(columns[check], return_index = True)[1][:samplesize + 1]
+    if len(sample) < 2:
+        return []
+    sigs = []
+    for curtok in candidates:
+        values = columns[curtok][sample]
+        sigs += [(values ^ values[0]) & (modulus - 1) if op == "xor" else (values - values[0]) % modulus]
+    sigs = numpy.array(sigs, dtype = numpy.int64).reshape(len(candidates), len(sample))[:, 1:]
+    checkvals = columns[check][sample]
+    if op == "xor":
+        target = (checkvals ^ checkvals[0])[1:]
+    elif op == "sum":
+        target = ((checkvals - checkvals[0]) % modulus)[1:]
+    else:
+        target = ((checkvals[0] - checkvals) % modulus)[1:]
+    half = len(candidates) // 2
+    lowtable = {}
+    for mask, sig in enumerate(_subset_table(op, sigs[:half], modulus)):
+        lowtable.setdefault(sig.tobytes(), []).append(mask)
+    hightable = _subset_table(op, sigs[half:], modulus)
+    needed = target ^ hightable if op == "xor" else (target - hightable) % modulus
+    found = []
+    for highmask, curneed in enumerate(needed):
+        for lowmask in lowtable.get(curneed.tobytes(), []):
+            mask = lowmask | (highmask << half)
+            if not mask:
+                continue
+            tokens = [ candidates[x] for x in range(len(candidates)) if mask >> x & 1 ]
+            residue = check_residue(op, columns, tokens, check, modulus)
+            if numpy.all(residue == residue[0]):
+                found += [(tokens, int(residue[0]))]
+            maxjoins -= 1
+            if not maxjoins:
+                break
+        if not maxjoins:
+            break
+    return sorted(found, key = lambda x: (len(x[0]), x[0]))[:limit]
+
+def search_checks(columns, bounds, tokens = None, ops = CHECK_OPS, workers = 0, limit = 8):
+    '''Try every varying token as a check over the others, yielding (check, op, tokens, init, aliases)'''
+    #Constant tokens only move the initial value, and tokens equal to an earlier one are searched once,
+    #aliases maps each kept token to its duplicates
+    tokens = range(len(columns)) if tokens is None else tokens
+    varying = [ x for x in tokens if columns[x] is not None and numpy.any(columns[x] != columns[x][0]) ]
+    aliases = {}
+    for curtok in varying:
+        first = next(x for x in varying if numpy.array_equal(columns[x], columns[curtok]))
+        aliases.setdefault(first, []).extend([] if first == curtok else [curtok])
+    jobs = [ (x, y) for x in aliases for y in ops ]
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers = workers) if workers else None
+    try:
+        results = []
+        for check, op in jobs:
+            candidates = [ x for x in aliases if x != check ]
+            args = (op, columns, candidates, check, 1 << bounds[check][1], 16, limit)
+            results += [(check, op, executor.submit(solve_check, *args) if executor else solve_check(*args))]
+        for check, op, solutions in results:
+            for sol_tokens, init in (solutions.result() if executor else solutions):
+                yield check, op, sol_tokens, init, aliases
+    finally:
+        if executor:
+            executor.shutdown()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import bisect
+import re
+
+class BinExtTable:
+
+    MISSING = ("", "NONE")
+    OPERATORS = ("==", "!=", "<=", ">=", "<", ">")
+
+    def __init__(self, fields, rows):
+        '''Hold extended CSV rows column wise with a type per column, building indexes on first use'''
+        self._fields = list(fields)
+        self._rows = rows
+        self._columns = {}
+        self._types = {}
+        self._hashidx = {}
+        self._sortidx = {}
+        for curind, curfield in enumerate(self._fields):
+            self._types[curfield] = self._column_type([ x[curind] for x in rows ])
+            self._columns[curfield] = [ self._convert(curfield, x[curind]) for x in rows ]
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get_fields(self):
+        return self._fields
+
+    def get_row(self, rowind):
+        return self._rows[rowind]
+
+    def get_column(self, field):
+        '''Return the typed values of a column, None where missing'''
+        return self._columns[self._check_field(field)]
+
+    def get_type(self, field):
+        return self._types[self._check_field(field)]
+
+    def _column_type(self, values):
+        for coltype in (int, float):
+            try:
+                for curval in values:
+                    if curval not in self.MISSING:
+                        coltype(curval)
+                return coltype
+            except ValueError:
+                pass
+        return str
+
+    def _convert(self, field, value):
+        return None if value in self.MISSING else self._types[field](value)
+
+    def _check_field(self, field):
+        if field not in self._columns:
+            raise KeyError("Field not listed: " + field)
+        return field
+
+    def _hash_index(self, field):
+        '''Map every value of a column to the ascending list of rows holding it'''
+        if field not in self._hashidx:
+            curidx = {}
+            for rowind, curval in enumerate(self._columns[field]):
+                curidx.setdefault(curval, []).append(rowind)
+            self._hashidx[field] = curidx
+        return self._hashidx[field]
+
+    def _sort_index(self, field):
+        '''Sorted present values of a column and the rows they come from, in matching order'''
+        if field not in self._sortidx:
+            present = sorted([ (x, y) for y, x in enumerate(self._columns[field]) if x is not None ])
+            self._sortidx[field] = ([ x[0] for x in present ], [ x[1] for x in present ])
+        return self._sortidx[field]
+
+    def match(self, field, op, value):
+        '''Return the set of rows where the column compares to value with op'''
+        self._check_field(field)
+        try:
+            value = self._convert(field, value)
+        except ValueError:
+            raise ValueError("Invalid value for " + self._types[field].__name__ + " field " + field + ": " + value)
+        if op == "==":
+            return set(self._hash_index(field).get(value, []))
+        if op == "!=":
+            return set(range(len(self))) - set(self._hash_index(field).get(value, []))
+        if op not in self.OPERATORS:
+            raise ValueError("Invalid operator: " + op)
+        if value is None:
+            return set()
+        keys, rowinds = self._sort_index(field)
+        if op == "<":
+            return set(rowinds[:bisect.bisect_left(keys, value)])
+        if op == "<=":
+            return set(rowinds[:bisect.bisect_right(keys, value)])
+        if op == ">":
+            return set(rowinds[bisect.bisect_right(keys, value):])
+        return set(rowinds[bisect.bisect_left(keys, value):])
+
+    def match_text(self, field, value):
+        '''Return the set of rows where the column holds exactly the CSV text value, without typing it'''
+        valind = self._fields.index(self._check_field(field))
+        return set([ x for x, y in enumerate(self._rows) if y[valind] == value ])
+
+    def select(self, conditions):
+        '''Return the ascending rows matching every (field, op, value) condition, all rows if there are none'''
+        matches = sorted([ self.match(*x) for x in conditions ], key = len)
+        if not matches:
+            return list(range(len(self)))
+        return sorted(matches[0].intersection(*matches[1:]))
+
+    def order(self, rowinds, sortkeys):
+        '''Stable sort rows by a list of fields, descending for a leading "-", missing values last'''
+        rowinds = list(rowinds)
+        for curkey in reversed(sortkeys):
+            field = self._check_field(curkey.lstrip("-"))
+            column = self._columns[field]
+            present = [ x for x in rowinds if column[x] is not None ]
+            present.sort(key = column.__getitem__, reverse = curkey.startswith("-"))
+            rowinds = present + [ x for x in rowinds if column[x] is None ]
+        return rowinds
+
+    @classmethod
+    def parse_condition(cls, condition):
+        '''Split "FIELD<op>VALUE" into a (field, op, value) tuple'''
+        parts = re.match("^([^=!<>]+)(" + "|".join(cls.OPERATORS) + ")(.*)$", condition)
+        if not parts:
+            raise ValueError("Invalid condition: " + condition)
+        return parts.group(1).strip(), parts.group(2), parts.group(3).strip()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import numpy
+
+def bit_entropy(bitmat):
+    '''Shannon entropy in bits of every column of a 0/1 matrix'''
+    ones = bitmat.mean(axis = 0)
+    with numpy.errstate(divide = "ignore", invalid = "ignore"):
+        entropy = -(ones * numpy.log2(ones) + (1 - ones) * numpy.log2(1 - ones))
+    return numpy.nan_to_num(entropy)
+
+def _standardize(mat):
+    '''Center every column and scale it to unit variance, constant columns stay zero'''
+    mat = mat.astype(numpy.float32)
+    mat -= mat.mean(axis = 0)
+    stddev = mat.std(axis = 0)
+    mat[:, stddev > 0] /= stddev[stddev > 0]
+    return mat
+
+def bit_correlation(bitmat):
+    '''Pearson correlation between every pair of columns, zero where either column is constant'''
+    stdmat = _standardize(bitmat)
+    return stdmat.T @ stdmat / len(bitmat)
+
+def attribute_correlation(bitmat, values):
+    '''Pearson correlation of every column with an attribute vector, skipping rows where it is NaN'''
+    present = ~numpy.isnan(values)
+    stdvals = _standardize(values[present, None])
+    return (_standardize(bitmat[present]).T @ stdvals)[:, 0] / present.sum()
+
+def symbol_period(entropy, minlen = 3, maxlen = 16, minscore = 0.5, tolerance = 0.05):
+    '''Return the shortest lag at which the entropy profile clearly repeats itself and the correlation there, or None'''
+    variable = numpy.flatnonzero(entropy > 0)
+    if not len(variable):
+        return None
+    profile = entropy[variable[0]:variable[-1] + 1]
+    scores = {}
+    for lag in range(max(minlen - 1, 1), min(maxlen + 1, len(profile) // 2) + 1):
+        head, tail = profile[:-lag], profile[lag:]
+        if head.std() == 0 or tail.std() == 0:
+            continue
+        scores[lag] = float(numpy.corrcoef(head, tail)[0, 1])
+    #Any slow trend makes the correlation fall off with the lag so it peaks at the shortest one, only a local peak marks a period
+    peaks = [ x for x in range(minlen, maxlen + 1) if x in scores and scores[x] >= minscore and
+              scores[x] > scores.get(x - 1, -1) and scores[x] > scores.get(x + 1, -1) ]
+    if not peaks:
+        return None
+    #Multiples of the period repeat as well as the period itself
+    best = max([ scores[x] for x in peaks ])
+    lag = min([ x for x in peaks if scores[x] >= best - tolerance ])
+    return lag, scores[lag]
+
+def field_boundaries(entropy):
+    '''Split the columns into runs that are either constant or varying, as (start, length, varying) tuples'''
+    varying = entropy > 0
+    cuts = numpy.flatnonzero(varying[1:] != varying[:-1]) + 1
+    starts = numpy.concatenate(([0], cuts))
+    ends = numpy.concatenate((cuts, [len(entropy)]))
+    return [ (int(x), int(y - x), bool(varying[x])) for x, y in zip(starts, ends) ]
+
+def correlated_pairs(corrmat, threshold = 0.9, limit = 10):
+    '''Return up to limit column pairs whose absolute correlation is at least threshold, strongest first'''
+    upper = numpy.triu(numpy.abs(corrmat), k = 1)
+    first, second = numpy.nonzero(upper >= threshold)
+    order = numpy.argsort(-upper[first, second], kind = "stable")[:limit]
+    return [ (int(first[x]), int(second[x]), float(corrmat[first[x], second[x]])) for x in order ]
+
+def find_encodings(bitmat, values, maxwidth = 16, samplesize = 64):
+    '''Find bit ranges whose msb or lsb first value plus a constant offset equals the attribute, as (start, width, order, offset)'''
+    present = ~numpy.isnan(values)
+    if present.sum() < 2 or numpy.any(values[present] != numpy.trunc(values[present])):
+        return []
+    target = values[present].astype(numpy.int64)
+    if numpy.all(target == target[0]):
+        return []
+    bits = bitmat[present].astype(numpy.int64)
+    found = []
+    for start, width, order in _encoding_candidates(bits, target, maxwidth, samplesize):
+        weights = 1 << numpy.arange(width, dtype = numpy.int64)
+        encvals = bits[:, start:start + width] @ (weights[::-1] if order == "msb" else weights)
+        offsets = target - encvals
+        if numpy.all(offsets == offsets[0]) and not any(x[0] >= start and x[0] + x[1] <= start + width for x in found):
+            found += [(start, width, order, int(offsets[0]))]
+    return found
+
+def _encoding_candidates(bits, target, maxwidth, samplesize):
+    '''Yield (start, width, order) ranges matching on rows with distinct attribute values, narrowest first'''
+    sample = numpy.unique(target, return_index = True)[1][:samplesize]
+    bits, target = bits[sample], target[sample]
+    msbvals = numpy.zeros(bits.shape, dtype = numpy.int64)
+    lsbvals = numpy.zeros(bits.shape, dtype = numpy.int64)
+    for width in range(1, min(maxwidth, bits.shape[1]) + 1):
+        cols = bits.shape[1] - width + 1
+        newbits = bits[:, width - 1:width - 1 + cols]
+        msbvals = msbvals[:, :cols] * 2 + newbits
+        lsbvals = lsbvals[:, :cols] + (newbits << (width - 1))
+        for order, encvals in (("msb", msbvals), ("lsb", lsbvals)):
+            offsets = target[:, None] - encvals
+            for start in numpy.flatnonzero(numpy.all(offsets == offsets[0], axis = 0)).tolist():
+                yield start, width, order
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+import pymakint
+import argparse
+import csv
+import glob
+import io
+import mmap
+import os
+import struct
+import time
+
+class PyMAGArchive:
+    '''Append-only container holding many captures, with a sidecar index of record offsets and timestamps
+
+    File layout: "PMAR", u16 version, u16 field list length, field list as a CSV line,
+    then per capture "PMRC", u32 raw length, f64 timestamp, u16 extended length,
+    u16 port length, extended values as a CSV line, the port the capture came
+    from and the raw tick data. Version 1 records have no port. The .idx sidecar holds
+    one (u64 offset, f64 timestamp) entry per capture and is rebuilt by scanning
+    the archive whenever it is missing or behind. Read-only opens never modify
+    either file and keep a rebuilt index in memory.'''
+
+    MAGIC = b"PMAR"
+    VERSION = 2
+    HEADER = struct.Struct("<4sHH")
+    RECMAGIC = b"PMRC"
+    RECORDS = {1: struct.Struct("<4sIdH"), 2: struct.Struct("<4sIdHH")}
+    INDEX = struct.Struct("<Qd")
+
+    def __init__(self, path, fields = None, readonly = False):
+        '''Open an archive, creating it with the given extended field names when it does not exist and is writable'''
+        if path[-4:] != ".pma":
+            raise ValueError("Filename must end with a .pma extension")
+        self._path = path
+        self._filemap = None
+        self._readonly = readonly
+        if not readonly and not os.path.exists(path):
+            fieldbytes = ",".join(fields if fields else []).encode()
+            with open(path, "wb") as fileh:
+                fileh.write(PyMAGArchive.HEADER.pack(PyMAGArchive.MAGIC, PyMAGArchive.VERSION, len(fieldbytes)) + fieldbytes)
+            open(path + ".idx", "wb").close()
+        self._fileh = open(path, "rb" if readonly else "r+b")
+        header = self._fileh.read(PyMAGArchive.HEADER.size)
+        if len(header) != PyMAGArchive.HEADER.size:
+            self._fileh.close()
+            raise ValueError("Error parsing archive, invalid header")
+        magic, version, fieldlen = PyMAGArchive.HEADER.unpack(header)
+        if magic != PyMAGArchive.MAGIC or version not in PyMAGArchive.RECORDS:
+            self._fileh.close()
+            raise ValueError("Error parsing archive, invalid header")
+        #Older archives keep their record layout, captures appended to them are stored without a port
+        self._version = version
+        self._record = PyMAGArchive.RECORDS[version]
+        self._fields = self._fileh.read(fieldlen).decode().split(",") if fieldlen else []
+        self._dataoffset = PyMAGArchive.HEADER.size + fieldlen
+        if readonly:
+            self._idxh = open(path + ".idx", "rb") if os.path.exists(path + ".idx") else None
+        else:
+            self._idxh = open(path + ".idx", "r+b" if os.path.exists(path + ".idx") else "w+b")
+        self._index = bytearray(self._idxh.read() if self._idxh else b"")
+        self._recover_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._index) // PyMAGArchive.INDEX.size
+
+    def __getitem__(self, recnum):
+        if not -len(self) <= recnum < len(self):
+            raise IndexError("Archive index out of range")
+        return self.get(recnum % len(self))
+
+    def __iter__(self):
+        for recnum in range(len(self)):
+            yield self.get(recnum)
+
+    def _recover_index(self):
+        '''Index any records past the last indexed one, resyncing on the next record magic after a damaged record.
+        Only a writable archive drops a partially written tail, and only when no valid record follows it'''
+        filesize = os.fstat(self._fileh.fileno()).st_size
+        idxsize = len(self._index)
+        del self._index[len(self._index) - (len(self._index) % PyMAGArchive.INDEX.size):]
+        offset = self._dataoffset
+        if len(self):
+            offset = self._record_end(self._entry(len(self) - 1)[0])
+            if offset > filesize:
+                del self._index[:]
+                offset = self._dataoffset
+        newentries = bytearray()
+        while offset < filesize:
+            recheader = self._valid_record(offset, filesize)
+            if recheader is None:
+                nextoffset = self._next_record(offset + 1, filesize)
+                if nextoffset is None:
+                    break
+                offset = nextoffset
+                continue
+            newentries += PyMAGArchive.INDEX.pack(offset, recheader[1])
+            offset = self._record_end(offset)
+        self._index += newentries
+        if self._readonly:
+            return
+        if offset < filesize:
+            self._fileh.truncate(offset)
+        if newentries or len(self._index) != idxsize:
+            self._idxh.seek(0)
+            self._idxh.write(self._index)
+            self._idxh.truncate()
+            self._idxh.flush()
+
+    def _unpack_record(self, recheader):
+        '''Return the magic, raw length, timestamp, extended length and port length of a record header'''
+        fields = self._record.unpack(recheader)
+        return fields if self._version > 1 else fields + (0,)
+
+    def _valid_record(self, offset, filesize):
+        '''Return the raw length, timestamp, extended length and port length of a complete record at offset, or None'''
+        if offset + self._record.size > filesize:
+            return None
+        self._fileh.seek(offset)
+        recmagic, rawlen, timestamp, extlen, portlen = self._unpack_record(self._fileh.read(self._record.size))
+        if recmagic != PyMAGArchive.RECMAGIC or (rawlen % 2) != 0 or offset + self._record.size + extlen + portlen + rawlen > filesize:
+            return None
+        return rawlen, timestamp, extlen, portlen
+
+    def _next_record(self, offset, filesize):
+        '''Return the offset of the next complete record at or after offset, or None'''
+        self._remap()
+        while True:
+            offset = self._filemap.find(PyMAGArchive.RECMAGIC, offset)
+            if offset == -1:
+                return None
+            if self._valid_record(offset, filesize) is not None:
+                return offset
+            offset += 1
+
+    def _entry(self, recnum):
+        return PyMAGArchive.INDEX.unpack_from(self._index, recnum * PyMAGArchive.INDEX.size)
+
+    def _record_end(self, offset):
+        self._fileh.seek(offset)
+        recheader = self._fileh.read(self._record.size)
+        if len(recheader) != self._record.size:
+            return float("inf")
+        recmagic, rawlen, timestamp, extlen, portlen = self._unpack_record(recheader)
+        return offset + self._record.size + extlen + portlen + rawlen
+
+    def _map_record(self, recnum):
+        '''Return the raw length, extended length and port length of a record and the offset of its payload'''
+        offset = self._entry(recnum)[0]
+        if self._filemap is None or len(self._filemap) < offset + self._record.size:
+            self._remap()
+        recmagic, rawlen, timestamp, extlen, portlen = self._unpack_record(self._filemap[offset:offset + self._record.size])
+        if len(self._filemap) < offset + self._record.size + extlen + portlen + rawlen:
+            self._remap()
+        return rawlen, extlen, portlen, offset + self._record.size
+
+    def _remap(self):
+        self._fileh.flush()
+        if self._filemap is not None:
+            self._filemap.close()
+        self._filemap = mmap.mmap(self._fileh.fileno(), 0, access = mmap.ACCESS_READ)
+
+    def get_fields(self):
+        '''Return the extended field names stored with the archive'''
+        return list(self._fields)
+
+    def get(self, recnum, datclass = pymakint.PyMAKDat):
+        '''Return a capture as a PyMAKDat'''
+        rawlen, extlen, portlen, payload = self._map_record(recnum)
+        payload += extlen + portlen
+        return datclass(self._filemap[payload:payload + rawlen])
+
+    def get_timestamp(self, recnum):
+        return self._entry(recnum)[1]
+
+    def get_extended(self, recnum):
+        '''Return the extended values stored with a capture'''
+        rawlen, extlen, portlen, payload = self._map_record(recnum)
+        extline = self._filemap[payload:payload + extlen].decode()
+        return next(csv.reader([extline])) if extline else []
+
+    def get_port(self, recnum):
+        '''Return the port a capture was read from, or None when it was not recorded'''
+        rawlen, extlen, portlen, payload = self._map_record(recnum)
+        return self._filemap[payload + extlen:payload + extlen + portlen].decode() if portlen else None
+
+    def append(self, cdata, extvals = None, timestamp = None, port = None):
+        '''Append a capture with optional extended values and source port, returning its record number'''
+        if self._readonly:
+            raise ValueError("Archive opened read-only")
+        rawdata = cdata.get_raw_data()
+        extbytes = csv_line(extvals).encode() if extvals else b""
+        timestamp = time.time() if timestamp is None else timestamp
+        self._fileh.seek(0, os.SEEK_END)
+        offset = self._fileh.tell()
+        portbytes = port.encode() if port and self._version > 1 else b""
+        recheader = (PyMAGArchive.RECMAGIC, len(rawdata), timestamp, len(extbytes)) + ((len(portbytes),) if self._version > 1 else ())
+        self._fileh.write(self._record.pack(*recheader) + extbytes + portbytes + rawdata)
+        entry = PyMAGArchive.INDEX.pack(offset, timestamp)
+        self._index += entry
+        self._idxh.seek(0, os.SEEK_END)
+        self._idxh.write(entry)
+        return len(self) - 1
+
+    def sync(self):
+        '''Flush appended captures and their index entries to disk'''
+        if self._readonly:
+            return
+        for fileh in (self._fileh, self._idxh):
+            fileh.flush()
+            os.fsync(fileh.fileno())
+
+    def close(self):
+        if self._filemap is not None:
+            self._filemap.close()
+            self._filemap = None
+        self._fileh.close()
+        if self._idxh:
+            self._idxh.close()
+
+def csv_line(values):
+    '''Format values as one CSV line, quoting those that need it'''
+    line = io.StringIO()
+    csv.writer(line, lineterminator = "").writerow(values)
+    return line.getvalue()
+
+def command_import(ags):
+    extrows = [ x for x in csv.reader(ags.extended) if len(x) ] if ags.extended else [None]
+    inpfiles = []
+    for inparg in ags.files:
+        if os.path.isdir(inparg):
+            inpfiles += sorted(glob.glob(os.path.join(glob.escape(inparg), "*.mag")))
+        else:
+            inpfiles += [inparg]
+    with PyMAGArchive(ags.archive, extrows[0]) as archive:
+        extrows = extrows[1:]
+        for filenum, inpfile in enumerate(inpfiles):
+            try:
+                cdata = pymakint.PyMAKDat(inpfile)
+            except (ValueError, OSError) as e:
+                print(inpfile + ": " + str(e))
+                continue
+            archive.append(cdata, extrows[filenum] if filenum < len(extrows) else None, os.path.getmtime(inpfile))
+        archive.sync()
+        print("Archive holds " + str(len(archive)) + " captures")
+
+def command_export(ags):
+    with PyMAGArchive(ags.archive, readonly = True) as archive:
+        extfile = None
+        if archive.get_fields():
+            extfile = open(ags.prefix + "-ext.csv", "w", newline = "")
+            extwriter = csv.writer(extfile, lineterminator = "\n")
+            extwriter.writerow(archive.get_fields())
+        for recnum in range(len(archive)):
+            outfile = ags.prefix + "-" + str(recnum + 1).zfill(3) + ".mag"
+            archive.get(recnum).save_file(outfile, atomic = True)
+            os.utime(outfile, (archive.get_timestamp(recnum), archive.get_timestamp(recnum)))
+            if extfile:
+                extvals = archive.get_extended(recnum)
+                extwriter.writerow(extvals if extvals else ["NONE"] * len(archive.get_fields()))
+        if extfile:
+            extfile.close()
+        print("Exported " + str(len(archive)) + " captures")
+
+def command_list(ags):
+    with PyMAGArchive(ags.archive, readonly = True) as archive:
+        if archive.get_fields():
+            print("fields: " + csv_line(archive.get_fields()))
+        for recnum in range(len(archive)):
+            port = archive.get_port(recnum)
+            print(str(recnum + 1).rjust(6) + " " + time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(archive.get_timestamp(recnum))) +
+                  (" " + port if port else "") + " " + csv_line(archive.get_extended(recnum)))
+
+if __name__ == '__main__':
+
+    agp = argparse.ArgumentParser(description="Pack .mag captures into .pma archives and back")
+    agsub = agp.add_subparsers(dest="command", required=True)
+    agimp = agsub.add_parser("import", help="Append .mag files to an archive")
+    agimp.add_argument("archive", help="Archive file, created when missing", type=str)
+    agimp.add_argument("files", help=".MAG files to import, or directories holding them", nargs="+", type=str)
+    agimp.add_argument("-e", "--extended", help="Extended CSV file with one line per imported file", type=argparse.FileType('r'))
+    agexp = agsub.add_parser("export", help="Write every capture of an archive to PREFIX-NNN.mag")
+    agexp.add_argument("archive", help="Archive file", type=str)
+    agexp.add_argument("prefix", help="Output file prefix", type=str)
+    aglst = agsub.add_parser("list", help="List the captures in an archive")
+    aglst.add_argument("archive", help="Archive file", type=str)
+    ags = agp.parse_args()
+
+    if ags.command == "import":
+        command_import(ags)
+    elif ags.command == "export":
+        command_export(ags)
+    elif ags.command == "list":
+        command_list(ags)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import pymakint
+import collections
+import concurrent.futures
+import os
+
+def decode_files(inpfiles, decode_func, track):
+    '''Load and decode a list of .mag files, returning (file, result, error, load failed) for each one'''
+    results = []
+    for inpfile in inpfiles:
+        try:
+            cdata = pymakint.PyMAKDat(inpfile)
+        except (ValueError, OSError) as e:
+            results += [(inpfile, None, str(e), True)]
+            continue
+        try:
+            results += [(inpfile, decode_func(cdata, track), None, False)]
+        except Exception as e:
+            results += [(inpfile, None, str(e), False)]
+    return results
+
+def bulk_decode(inpfiles, decode_func, track, workers = None, chunksize = 16, cache = None):
+    '''Decode .mag files in a process pool, or in process when workers is 0, yielding (file, result, error, load failed) in input order'''
+    workers = os.cpu_count() if workers == None else workers
+    pending = collections.deque()
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers = workers) if workers else None
+    try:
+        for chunk in _chunk_files(inpfiles, chunksize):
+            pending.append(_submit_chunk(executor, chunk, decode_func, track, cache))
+            if len(pending) > max(workers, 1) * 2:
+                yield from _collect_chunk(pending.popleft(), cache)
+        while pending:
+            yield from _collect_chunk(pending.popleft(), cache)
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures = True)
+
+def _chunk_files(inpfiles, chunksize):
+    chunk = []
+    for inpfile in inpfiles:
+        chunk += [inpfile]
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _submit_chunk(executor, chunk, decode_func, track, cache):
+    '''Resolve what the cache holds for a chunk and start decoding the rest'''
+    keys = [None] * len(chunk)
+    cached = [None] * len(chunk)
+    if cache:
+        for curfile in range(len(chunk)):
+            try:
+                keys[curfile] = cache.make_key(chunk[curfile], decode_func, track)
+            except OSError:
+                continue
+            cached[curfile] = cache.lookup(keys[curfile])
+    misses = [ chunk[x] for x in range(len(chunk)) if cached[x] == None ]
+    if executor and misses:
+        future = executor.submit(decode_files, misses, decode_func, track)
+    else:
+        future = concurrent.futures.Future()
+        future.set_result(decode_files(misses, decode_func, track))
+    return chunk, keys, cached, future
+
+def _collect_chunk(submitted, cache):
+    '''Merge cached and freshly decoded results of a chunk back into input order'''
+    chunk, keys, cached, future = submitted
+    decoded = iter(future.result())
+    for curfile in range(len(chunk)):
+        if cached[curfile] != None:
+            yield (chunk[curfile],) + tuple(cached[curfile]) + (False,)
+            continue
+        result = next(decoded)
+        #Files that fail to load are reported again on every run instead of being cached
+        if cache and keys[curfile] and not result[3]:
+            cache.store(keys[curfile], result[1], result[2])
+        yield result
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import pymagpar
+import hashlib
+import sqlite3
+import time
+
+class PyMAGCache:
+
+    CACHENAME = ".pymagcache.db"
+
+    def __init__(self, path, maxentries = 100000, commitevery = 256):
+        '''Open or create a decode cache, keeping at most maxentries results'''
+        self._maxentries = maxentries
+        self._commitevery = commitevery
+        self._pending = 0
+        self._dbh = sqlite3.connect(path)
+        self._dbh.execute("CREATE TABLE IF NOT EXISTS decodes (key TEXT PRIMARY KEY, result TEXT, error TEXT, used REAL)")
+        self._dbh.execute("CREATE INDEX IF NOT EXISTS decodes_used ON decodes (used)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def make_key(inpfile, decode_func, track):
+        '''Build the cache key from the file contents and the decoder name, version and track'''
+        with open(inpfile, "rb") as fileh:
+            digest = hashlib.sha256(fileh.read()).hexdigest()
+        decname = decode_func.__name__
+        return ":".join([digest, decname, str(pymagpar.DECODER_VERSIONS.get(decname, 0)), str(track)])
+
+    def lookup(self, key):
+        '''Return the cached (result, error) pair for a key, or None'''
+        row = self._dbh.execute("SELECT result, error FROM decodes WHERE key = ?", (key,)).fetchone()
+        if row:
+            self._dbh.execute("UPDATE decodes SET used = ? WHERE key = ?", (time.time(), key))
+            self._written()
+        return row
+
+    def store(self, key, result, error):
+        '''Store a decoded string or error message for a key'''
+        self._dbh.execute("INSERT OR REPLACE INTO decodes VALUES (?, ?, ?, ?)",
+                          (key, None if result is None else str(result), error, time.time()))
+        self._written()
+
+    def _written(self):
+        self._pending += 1
+        if self._pending >= self._commitevery:
+            self.flush()
+
+    def flush(self):
+        '''Evict the least recently used entries above the size cap and commit'''
+        rowcount = self._dbh.execute("SELECT COUNT(*) FROM decodes").fetchone()[0]
+        if rowcount > self._maxentries:
+            self._dbh.execute("DELETE FROM decodes WHERE key IN (SELECT key FROM decodes ORDER BY used LIMIT ?)",
+                              (rowcount - self._maxentries,))
+        self._dbh.commit()
+        self._pending = 0
+
+    def close(self):
+        self.flush()
+        self._dbh.close()
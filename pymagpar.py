@@ -1,3 +1,14 @@
+import functools
+import itertools
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#Bump a decoder's version whenever its output changes, cached results are keyed on it
+DECODER_VERSIONS = {"raw_decode": 1, "f2f_raw_decode": 1, "p1v_decode": 1, "f2f_adaptive_raw_decode": 1, "p1v_adaptive_decode": 3}
+
 def raw_decode(cdata, track):
     '''Decode stream into raw timing values'''
     retstr = ""
@@ -6,24 +17,173 @@ def raw_decode(cdata, track):
         retstr += str(ctdata) + " "
     return retstr
 
-def f2f_raw_decode(cdata, track):
-    '''Decode F2F bitstream represented by timing values into binary string'''
-    tvalues = cdata.get_raw_track_timing(track)
+class F2FParseError(TypeError):
+    '''Raised when a timing value falls outside the F2F bit windows'''
+    
+    def __init__(self, message, position):
+        super().__init__(message)
+        self.position = position
+
+class F2FBits:
+    '''Decoded bitstream stored as one 0/1 byte per bit, rendered as a "0101" string'''
+    
+    __slots__ = ("_bits",)
+    
+    _TOCHARS = bytes.maketrans(b"\x00\x01", b"01")
+    _FROMCHARS = bytes.maketrans(b"01", b"\x00\x01")
+    
+    def __init__(self, bits = None):
+        if isinstance(bits, str):
+            bits = bits.encode().translate(F2FBits._FROMCHARS)
+        self._bits = bytearray(bits) if bits else bytearray()
+    
+    def __len__(self):
+        return len(self._bits)
+    
+    def __str__(self):
+        return self._bits.translate(F2FBits._TOCHARS).decode()
+    
+    def __repr__(self):
+        return "F2FBits('" + str(self) + "')"
+    
+    def __eq__(self, other):
+        if isinstance(other, F2FBits):
+            return self._bits == other._bits
+        if isinstance(other, str):
+            return str(self) == other
+        return NotImplemented
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return F2FBits(self._bits[index])
+        return self._bits[index]
+    
+    def find(self, pattern, start = 0):
+        '''Return the index of the first occurrence of a "0101" pattern, or -1'''
+        return self._bits.find(pattern.encode().translate(F2FBits._FROMCHARS), start)
+    
+    def to_int(self, start = 0, stop = None):
+        '''Return the bits between start and stop as an integer, first bit most significant'''
+        return int(self._bits[start:stop].translate(F2FBits._TOCHARS) or b"0", 2)
+
+def _f2f_seed(tvalues, tloop):
+    '''Estimate the initial zero bit duration from the leading clock bits'''
+    if len(tvalues) < tloop:
+        raise F2FParseError("F2F parse error", 0)
+    return sum(tvalues[1:tloop])/len(tvalues[1:tloop])
+
+def f2f_bits(tvalues):
+    '''Decode F2F timing values into a bit vector'''
+    tloop = 10
+    bits = bytearray(tloop)
+    zerotime = _f2f_seed(tvalues, tloop)
+    tend = len(tvalues)-2
+    while tloop < tend:
+        curtime = tvalues[tloop]
+        if curtime < ((zerotime*3)/4) and tvalues[tloop+1] > (zerotime/4):
+            zerotime = curtime + tvalues[tloop+1]
+            tloop += 2
+            bits.append(1)
+        elif curtime < (zerotime*1.25) and curtime > (zerotime*0.75):
+            zerotime = curtime
+            tloop += 1
+            bits.append(0)
+        else:
+            raise F2FParseError("F2F parse error", tloop)
+    return F2FBits(bits)
+
+def f2f_bits_numpy(tvalues):
+    '''Decode F2F timing values into a bit vector, classifying all intervals with array operations'''
+    tloop = 10
+    bits = bytearray(tloop)
+    zerotime = _f2f_seed(tvalues, tloop)
+    tend = len(tvalues)-2
+    if tloop >= tend:
+        return F2FBits(bits)
+    tarr = numpy.asarray(tvalues, dtype = numpy.int64)
+    curtime, nexttime = tarr[2:-1], tarr[3:]
+    #Bit class at each interval, for a preceding 0 bit and for a preceding 1 bit
+    bitclass = []
+    for prevtime in (tarr[1:-2], tarr[1:-2] + tarr[0:-3]):
+        isone = (curtime < ((prevtime*3)/4)) & (nexttime > (prevtime/4))
+        iszero = (curtime < (prevtime*1.25)) & (curtime > (prevtime*0.75))
+        bitclass += [numpy.where(isone, 1, numpy.where(iszero, 0, -1)).tolist()]
+    if tvalues[tloop] < ((zerotime*3)/4) and tvalues[tloop+1] > (zerotime/4):
+        curbit = 1
+    elif tvalues[tloop] < (zerotime*1.25) and tvalues[tloop] > (zerotime*0.75):
+        curbit = 0
+    else:
+        raise F2FParseError("F2F parse error", tloop)
+    while True:
+        bits.append(curbit)
+        tloop += 1 + curbit
+        if tloop >= tend:
+            return F2FBits(bits)
+        curbit = bitclass[curbit][tloop-2]
+        if curbit < 0:
+            raise F2FParseError("F2F parse error", tloop)
+
+def f2f_bits_adaptive(tvalues, gain = 0.3, maxresync = 2):
+    '''Decode F2F timing values into a bit vector, tracking the bit period with a first order clock recovery loop'''
     tloop = 10
-    pstr = "0" * tloop
-    zerotime = sum(tvalues[1:tloop])/len(tvalues[1:tloop])
-    while tloop < len(tvalues)-2:
-        if tvalues[tloop] < ((zerotime*3)/4) and tvalues[tloop+1] > (zerotime/4):
-            zerotime = tvalues[tloop] + tvalues[tloop+1]
+    bits = bytearray(tloop)
+    zerotime = _f2f_seed(tvalues, tloop)
+    tend = len(tvalues)-2
+    carry = 0
+    resyncs = 0
+    while tloop < tend:
+        curtime = tvalues[tloop] + carry
+        carry = 0
+        if curtime < ((zerotime*3)/4) and tvalues[tloop+1] > (zerotime/4):
+            period = curtime + tvalues[tloop+1]
             tloop += 2
-            pstr += "1"
-        elif tvalues[tloop] < (zerotime*1.25) and tvalues[tloop] > (zerotime*0.75):
-            zerotime = tvalues[tloop]
+            bits.append(1)
+        elif curtime < (zerotime*1.5) and curtime > (zerotime*0.75):
+            period = curtime
+            tloop += 1
+            bits.append(0)
+        elif resyncs < maxresync and curtime <= (zerotime*0.75):
+            #Spurious transition, fold the glitch into the next interval
+            carry = curtime
             tloop += 1
-            pstr += "0"
+            resyncs += 1
+            continue
+        elif resyncs < maxresync:
+            #Missed transitions, count the long interval as whole zero bits
+            zerocount = round(curtime / zerotime)
+            period = curtime / zerocount
+            tloop += 1
+            bits.extend(bytes(zerocount))
+            resyncs += 1
         else:
-            raise TypeError("F2F parse error")
-    return pstr
+            raise F2FParseError("F2F parse error", tloop)
+        zerotime += gain * (period - zerotime)
+    return F2FBits(bits)
+
+def f2f_bits_both(tvalues, decode_func = f2f_bits_adaptive):
+    '''Decode a swipe forward and then on the reversed timing for backward swipes, yielding (backward, bits) with None
+       for a failed direction, the reversed decode only runs when the caller asks for it'''
+    for backward, curvalues in enumerate((tvalues, tvalues[::-1])):
+        try:
+            yield bool(backward), decode_func(curvalues)
+        except F2FParseError:
+            yield bool(backward), None
+
+def f2f_decode(cdata, track):
+    '''Decode F2F bitstream represented by timing values into a bit vector'''
+    return f2f_bits(cdata.get_raw_track_timing(track))
+
+def f2f_decode_numpy(cdata, track):
+    '''Decode F2F bitstream represented by timing values into a bit vector using numpy'''
+    return f2f_bits_numpy(cdata.get_raw_track_timing(track))
+
+def f2f_raw_decode(cdata, track):
+    '''Decode F2F bitstream represented by timing values into binary string'''
+    return str(f2f_decode(cdata, track))
+
+def f2f_adaptive_raw_decode(cdata, track):
+    '''Decode F2F bitstream into binary string with adaptive clock recovery'''
+    return str(f2f_bits_adaptive(cdata.get_raw_track_timing(track)))
 
 #def f2ft1v_decode():
 #    rbstream = f2f_raw_decode(cdata, track)
@@ -33,37 +193,103 @@ def f2f_raw_decode(cdata, track):
 #    rbstream = f2f_raw_decode(cdata, track)
 #    sind = rbstream.find("11111110")
 
-def p1v_decode(cdata, track):
-    '''Decode and check data from type 1 parking cards'''
-    rbstream = f2f_raw_decode(cdata, track)
-    sind = rbstream.find("11111110")
+_P1VREVERSED = bytes([ int(format(x, "08b")[::-1], 2) for x in range(256) ])
+_P1VINVERTED = bytes([ x ^ 0xFF for x in range(256) ])
+
+def p1v_check(rbits):
+    '''Check a type 1 parking card bitstream and return its 25 inverted symbols'''
+    sind = rbits.find("11111110")
     if sind == -1:
         raise TypeError("Start sentinel not found")
-    if (len(rbstream)-sind) < (25*8):
+    if (len(rbits)-sind) < (25*8):
         raise TypeError("Incomplete data stream")
-    symx = [None] * 25
-    for symi in range(25):
-        symid = sind + (symi*8)
-        symx[symi] = rbstream[symid:symid+8]
-    if symx[0] != symx[24][::-1]:
+    symx = rbits.to_int(sind, sind + (25*8)).to_bytes(25, "big")
+    if symx[0] != _P1VREVERSED[symx[24]]:
         raise TypeError("End sentinel mismatch")
-    for symi in range(1, 13):
-        if symx[symi] != symx[24-symi]:
-            raise TypeError("Repeat value mismatch")
+    if symx[1:13] != symx[23:11:-1]:
+        raise TypeError("Repeat value mismatch")
     xorcheck = 0xFF
-    for symi in range(1, 11):
-        xorcheck ^= int(symx[symi], 2)
-    if(xorcheck != int(symx[13], 2)):
+    for cursym in symx[1:11]:
+        xorcheck ^= cursym
+    if xorcheck != symx[13]:
         raise TypeError("Checksum mismatch")
-    for symi in range(25):
-        tmplst = list(symx[symi])
-        for curbit in range(len(tmplst)):
-            if tmplst[curbit] == '0':
-                tmplst[curbit] = '1'
-            else:
-                tmplst[curbit] = '0'
-        symx[symi] = ''.join(tmplst)
-    return ''.join(symx[:])
+    return symx.translate(_P1VINVERTED)
+
+def p1v_symbols(cdata, track):
+    '''Decode and check data from type 1 parking cards, returning the symbols as bytes'''
+    return p1v_check(f2f_decode(cdata, track))
+
+def p1v_decode(cdata, track):
+    '''Decode and check data from type 1 parking cards'''
+    return format(int.from_bytes(p1v_symbols(cdata, track), "big"), "0200b")
+
+def p1v_adaptive_symbols(cdata, track):
+    '''Decode with adaptive clock recovery and check data from type 1 parking cards, returning the symbols as bytes,
+       the reversed swipe is only tried when the forward decode fails'''
+    #A backward swipe decoded forward can still pass p1v_check with every symbol mirrored in place, the format
+    #can't tell the directions apart so the forward result always wins
+    error = F2FParseError("F2F parse error", 0)
+    for backward, rbits in f2f_bits_both(cdata.get_raw_track_timing(track)):
+        if rbits is None:
+            continue
+        try:
+            symx = p1v_check(rbits)
+        except TypeError as e:
+            error = e
+            continue
+        #The reversed stream holds the symbols last to first with their bits mirrored
+        return symx[::-1].translate(_P1VREVERSED) if backward else symx
+    raise error
+
+def p1v_adaptive_decode(cdata, track):
+    '''Decode and check data from type 1 parking cards, tolerating speed changes and backward swipes'''
+    return format(int.from_bytes(p1v_adaptive_symbols(cdata, track), "big"), "0200b")
+
+F2F_ZEROTIME = 200
+F2F_CHUNK = 8
+P1V_LEADZEROS = 32
+P1V_TRAILZEROS = 32
+
+@functools.lru_cache(maxsize = 4096)
+def _f2f_chunk_timing(chunk, zerotime):
+    '''Timing values of a few bits, cached so constant sentinels and fields are encoded once per batch'''
+    timing = []
+    for curbit in chunk:
+        timing += [zerotime // 2, zerotime - zerotime // 2] if curbit == "1" else [zerotime]
+    return tuple(timing)
+
+def f2f_encode_bits(rbits, zerotime = F2F_ZEROTIME):
+    '''Encode a binary string into F2F timing values, a full period for 0 and two half periods for 1'''
+    rbits = str(rbits)
+    if rbits.strip("01"):
+        raise TypeError("Invalid character in bitstream")
+    if not rbits.startswith("0" * 10):
+        raise TypeError("Bitstream must start with 10 clocking zeros")
+    return list(itertools.chain.from_iterable(_f2f_chunk_timing(rbits[x:x + F2F_CHUNK], zerotime) for x in range(0, len(rbits), F2F_CHUNK)))
+
+def raw_encode(cdata, track, str_rep):
+    '''Encode raw timing values given as a space separated string'''
+    try:
+        tvalues = [ int(x) for x in str_rep.split() ]
+    except ValueError:
+        raise TypeError("Invalid timing value")
+    cdata.set_raw_track_timing(track, tvalues)
+
+def f2f_raw_encode(cdata, track, str_rep):
+    '''Encode binary string into F2F timing values'''
+    #Decoding stops two timing values short of the end, trailing clock zeros keep the last bits readable
+    cdata.set_raw_track_timing(track, f2f_encode_bits(str_rep.strip() + "00"))
+
+def p1v_encode(cdata, track, str_rep):
+    '''Encode data for type 1 parking cards, checking it the way a read would'''
+    str_rep = str_rep.strip()
+    if len(str_rep) != 25*8 or str_rep.strip("01"):
+        raise TypeError("Data must be 200 binary digits")
+    symx = int(str_rep, 2).to_bytes(25, "big").translate(_P1VINVERTED)
+    #Leading zeros are a multiple of the chunk size so every symbol hits the encoding cache
+    rbits = "0" * P1V_LEADZEROS + format(int.from_bytes(symx, "big"), "0200b") + "0" * P1V_TRAILZEROS
+    p1v_check(F2FBits(rbits))
+    cdata.set_raw_track_timing(track, f2f_encode_bits(rbits))
 
 '''
 def _parking1_decode(nblob):
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+import pymakint
+import pymagpar
+import pymagbulk
+import binana
+import binext
+import argparse
+import csv
+import glob
+import os
+import random
+import sys
+import timeit
+import tracemalloc
+
+def list_captures(ags):
+    flist = sorted(glob.glob(os.path.join(ags.dir, "*.mag")))
+    if not flist:
+        print("Error: no .mag files found in " + ags.dir)
+        sys.exit(1)
+    return flist
+
+def load_rawdata(ags):
+    return [ pymakint.PyMAKDat(x)._rawdata for x in list_captures(ags) ]
+
+def bench_load(ags):
+    flist = list_captures(ags)
+    cdata = [ pymakint.PyMAKDat(x) for x in flist ]
+    runtime = min(timeit.repeat(lambda: [ x._load_file(y) for x, y in zip(cdata, flist) ],
+                                number = 1, repeat = ags.repeat))
+    print("Captures: " + str(len(flist)) + ", loader: " + ("numpy" if pymakint.numpy is not None else "struct"))
+    print("total   " + "{:10.2f} ms".format(runtime * 1000))
+    print("capture " + "{:10.3f} ms".format(runtime * 1000 / len(flist)))
+
+def bench_memory(ags):
+    flist = list_captures(ags)
+    for datclass in (pymakint.PyMAKDat, pymakint.PyMAKDatCompact):
+        tracemalloc.start()
+        cdata = [ datclass(x) for x in flist ]
+        for curcard in cdata:
+            str(curcard)
+        memused = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del cdata
+        print(datclass.__name__.ljust(16) + "{:10.1f} KiB total {:8.1f} KiB/capture".format(memused / 1024, memused / 1024 / len(flist)))
+
+def bench_bulk(ags):
+    flist = list_captures(ags) * ags.scale
+    serial = timeit.timeit(lambda: pymagbulk.decode_files(flist, pymagpar.p1v_decode, pymakint.PyMAKInt.TRACK2), number = 1)
+    print("Captures: " + str(len(flist)))
+    print("serial".ljust(10) + "{:10.2f} ms".format(serial * 1000))
+    workers = 1
+    while workers <= os.cpu_count():
+        runtime = timeit.timeit(lambda: list(pymagbulk.bulk_decode(flist, pymagpar.p1v_decode, pymakint.PyMAKInt.TRACK2, workers = workers)), number = 1)
+        print((str(workers) + " jobs").ljust(10) + "{:10.2f} ms {:6.2f}x".format(runtime * 1000, serial / runtime))
+        workers *= 2
+
+def load_bitlines(ags):
+    dlist = sorted(glob.glob(os.path.join(ags.dir, "*_data.txt")))
+    if not dlist:
+        print("Error: no _data.txt file found in " + ags.dir)
+        sys.exit(1)
+    with open(dlist[0]) as fileh:
+        bitlines = fileh.read().split()
+    return [ x.ljust(max([ len(y) for y in bitlines ]), "0") for x in bitlines ] * ags.scale
+
+def bench_weight(ags):
+    bitlines = load_bitlines(ags)
+    print("Lines: " + str(len(bitlines)) + ", bits: " + str(len(bitlines[0])))
+    engines = [("python", binana.calc_weight_list)]
+    if binana.numpy is not None:
+        engines += [("numpy", binana.calc_weight_numpy)]
+    for engname, weight_func in engines:
+        runtime = min(timeit.repeat(lambda: weight_func(ags, bitlines), number = 1, repeat = ags.repeat))
+        print(engname.ljust(8) + "{:10.2f} ms".format(runtime * 1000))
+
+def bench_query(ags):
+    elist = sorted(glob.glob(os.path.join(ags.dir, "*_ext.txt")))
+    if not elist:
+        print("Error: no _ext.txt file found in " + ags.dir)
+        sys.exit(1)
+    with open(elist[0]) as fileh:
+        extin = [ x for x in csv.reader(fileh) if len(x) ]
+    fields, rows = extin[0], extin[1:] * ags.scale
+    conditions = [("FHOUR", ">=", "11"), ("FHOUR", "<", "13"), ("PRICE", "==", "8")]
+    print("Rows: " + str(len(rows)))
+    runtime = min(timeit.repeat(lambda: binext.BinExtTable(fields, rows), number = 1, repeat = ags.repeat))
+    print("load".ljust(8) + "{:10.2f} ms".format(runtime * 1000))
+    table = binext.BinExtTable(fields, rows)
+    table.order(table.select(conditions), ["-PRICE", "FHOUR", "FMIN"])
+    runtime = min(timeit.repeat(lambda: table.order(table.select(conditions), ["-PRICE", "FHOUR", "FMIN"]), number = 1, repeat = ags.repeat))
+    print("query".ljust(8) + "{:10.2f} ms".format(runtime * 1000))
+
+def f2f_timing(bitcount):
+    tvalues = [200] * 10
+    for curbit in range(bitcount):
+        tvalues += [100, 100] if random.getrandbits(1) else [200]
+    return tvalues + [200, 200]
+
+def bench_f2f(ags):
+    tracks = [ pymakint.PyMAKDat(x).get_raw_track_timing(pymakint.PyMAKInt.TRACK2) for x in list_captures(ags) ]
+    tracks = [ x for x in tracks if len(x) ]
+    cases = [("captures", tracks)] + [ (str(x) + " bits", [f2f_timing(x)]) for x in (1000, 10000, 100000) ]
+    decoders = [("python", pymagpar.f2f_bits)]
+    if pymagpar.numpy is not None:
+        decoders += [("numpy", pymagpar.f2f_bits_numpy)]
+    for casename, tlist in cases:
+        for decname, decode_func in decoders:
+            runtime = min(timeit.repeat(lambda: [ f2f_try(decode_func, x) for x in tlist ], number = 1, repeat = ags.repeat))
+            print(casename.ljust(12) + decname.ljust(8) + "{:10.2f} ms".format(runtime * 1000))
+        bits = [ f2f_try(pymagpar.f2f_bits, x) for x in tlist ]
+        runtime = min(timeit.repeat(lambda: [ str(x) for x in bits if x ], number = 1, repeat = ags.repeat))
+        print(casename.ljust(12) + "str".ljust(8) + "{:10.2f} ms".format(runtime * 1000))
+
+def f2f_swipe_timing(bitcount, accel, jitter):
+    '''Timing of a random swipe whose bit period changes by accel per bit, every interval off by up to jitter'''
+    bits = [ random.getrandbits(1) for x in range(bitcount) ]
+    period = 200.0
+    tvalues = [200] * 10
+    for curbit in [0] * 10 + bits:
+        period *= accel
+        for curtime in ([period/2, period/2] if curbit else [period]):
+            tvalues += [round(curtime * (1 + random.uniform(-jitter, jitter)))]
+    return tvalues + [200, 200], "0" * 20 + "".join([ str(x) for x in bits ])
+
+def bench_adaptive(ags):
+    cdata = [ pymakint.PyMAKDat(x) for x in list_captures(ags) ]
+    decoders = [("fixed", pymagpar.p1v_decode), ("adaptive", pymagpar.p1v_adaptive_decode)]
+    print("Captures: " + str(len(cdata)))
+    for decname, decode_func in decoders:
+        results = [ p1v_try(x, decode_func) for x in cdata ]
+        runtime = min(timeit.repeat(lambda: [ p1v_try(x, decode_func) for x in cdata ], number = 1, repeat = ags.repeat))
+        print(decname.ljust(10) + "{:4d}/{} decoded {:10.2f} us/card".format(len([ x for x in results if x ]), len(cdata),
+                                                                            runtime * 1000000 / len(cdata)))
+    random.seed(0)
+    for accel, jitter in ((1.0, 0.1), (0.997, 0.15), (1.003, 0.15), (1.005, 0.2)):
+        swipes = [ f2f_swipe_timing(300, accel, jitter) for x in range(ags.scale * 20) ]
+        counts = []
+        for decode_func in (pymagpar.f2f_bits, pymagpar.f2f_bits_adaptive):
+            counts += [len([ x for x, y in swipes if str(f2f_try(decode_func, x)).startswith(y) ])]
+        print("accel {:.3f} jitter {:.2f}: fixed {:4d}/{} adaptive {:4d}/{}".format(accel, jitter, counts[0], len(swipes), counts[1], len(swipes)))
+
+def encode_cards(bitlines, cold):
+    cards = []
+    for curline in bitlines:
+        if cold:
+            pymagpar._f2f_chunk_timing.cache_clear()
+        cards += [pymakint.PyMAKDat()]
+        pymagpar.p1v_encode(cards[-1], pymakint.PyMAKInt.TRACK2, curline)
+    return cards
+
+def bench_encode(ags):
+    bitlines = load_bitlines(ags)
+    cards = encode_cards(bitlines, False)
+    decoded = len([ x for x, y in zip(cards, bitlines) if p1v_try(x, pymagpar.p1v_decode) == y ])
+    print("Cards: " + str(len(bitlines)) + ", " + str(decoded) + " decode back")
+    for cachename, cold in (("uncached", True), ("cached", False)):
+        runtime = min(timeit.repeat(lambda: encode_cards(bitlines, cold), number = 1, repeat = ags.repeat))
+        print(cachename.ljust(10) + "{:10.2f} us/card".format(runtime * 1000000 / len(bitlines)))
+    print(pymagpar._f2f_chunk_timing.cache_info())
+
+def bench_p1v(ags):
+    cdata = [ pymakint.PyMAKDat(x) for x in list_captures(ags) ]
+    bits = [ f2f_try(pymagpar.f2f_bits, x.get_raw_track_timing(pymakint.PyMAKInt.TRACK2)) for x in cdata ]
+    bits = [ x for x in bits if x ]
+    runtime = min(timeit.repeat(lambda: [ p1v_try(x) for x in bits ], number = 1, repeat = ags.repeat))
+    print("Bitstreams: " + str(len(bits)))
+    print("check   " + "{:10.2f} us/card".format(runtime * 1000000 / len(bits)))
+    runtime = min(timeit.repeat(lambda: [ p1v_try(x, pymagpar.p1v_decode) for x in cdata ], number = 1, repeat = ags.repeat))
+    print("decode  " + "{:10.2f} us/card".format(runtime * 1000000 / len(cdata)))
+
+def p1v_try(rbits, decode_func = None):
+    try:
+        if decode_func:
+            return decode_func(rbits, pymakint.PyMAKInt.TRACK2)
+        return pymagpar.p1v_check(rbits)
+    except TypeError:
+        return None
+
+def f2f_try(decode_func, tvalues):
+    try:
+        return decode_func(tvalues)
+    except pymagpar.F2FParseError:
+        return None
+
+def calc_tracks(rawlst, engine, tracks):
+    for rawdata in rawlst:
+        cdata = pymakint.PyMAKDat(rawdata, engine = engine)
+        for track in tracks:
+            cdata.get_raw_track_timing(track)
+
+def bench_timing(ags):
+    if pymakint.numpy is None:
+        print("Error: timing benchmark requires numpy")
+        sys.exit(2)
+    rawlst = load_rawdata(ags)
+    for rawdata in rawlst:
+        listdat = pymakint.PyMAKDat(rawdata, engine = pymakint.PyMAKDat.ENGINE_LIST)
+        npdat = pymakint.PyMAKDat(rawdata, engine = pymakint.PyMAKDat.ENGINE_NUMPY)
+        for track in (pymakint.PyMAKInt.TRACK1, pymakint.PyMAKInt.TRACK2, pymakint.PyMAKInt.TRACK3):
+            if list(listdat.get_raw_track_timing(track)) != npdat.get_raw_track_timing(track).tolist():
+                print("Error: engine output mismatch")
+                sys.exit(3)
+    print("Captures: " + str(len(rawlst)) + ", outputs identical")
+    alltracks = (pymakint.PyMAKInt.TRACK1, pymakint.PyMAKInt.TRACK2, pymakint.PyMAKInt.TRACK3)
+    for engine in (pymakint.PyMAKDat.ENGINE_LIST, pymakint.PyMAKDat.ENGINE_NUMPY):
+        for tracks in (alltracks, (pymakint.PyMAKInt.TRACK2,)):
+            runtime = min(timeit.repeat(lambda: calc_tracks(rawlst, engine, tracks), number = 1, repeat = ags.repeat))
+            print(engine.ljust(8) + ("all tracks" if len(tracks) == 3 else "track 2").ljust(12) + "{:10.2f} ms".format(runtime * 1000))
+
+if __name__ == '__main__':
+
+    agp = argparse.ArgumentParser()
+    agp.add_argument("benchmark", help="Benchmark to run", choices=["timing", "load", "memory", "bulk", "f2f", "p1v", "weight", "query", "adaptive", "encode"])
+    agp.add_argument("-d", "--dir", help="Directory with .mag captures, defaults to woodlands_bulk", type=str, default="woodlands_bulk")
+    agp.add_argument("-n", "--repeat", help="Number of repetitions, best run is reported", type=int, default=5)
+    agp.add_argument("-s", "--scale", help="Number of times the capture or line list is repeated for bulk, weight and query, "
+                                             "a twentieth of the synthetic swipes for adaptive, the line list for encode", type=int, default=10)
+    ags = agp.parse_args()
+
+    if ags.benchmark == "timing":
+        bench_timing(ags)
+    elif ags.benchmark == "load":
+        bench_load(ags)
+    elif ags.benchmark == "memory":
+        bench_memory(ags)
+    elif ags.benchmark == "bulk":
+        bench_bulk(ags)
+    elif ags.benchmark == "f2f":
+        bench_f2f(ags)
+    elif ags.benchmark == "p1v":
+        bench_p1v(ags)
+    elif ags.benchmark == "weight":
+        bench_weight(ags)
+    elif ags.benchmark == "query":
+        bench_query(ags)
+    elif ags.benchmark == "adaptive":
+        bench_adaptive(ags)
+    elif ags.benchmark == "encode":
+        bench_encode(ags)
@@ -5,10 +5,19 @@
 
 import pymakint
 import pymagpar
+import pymagbulk
+import pymagcache
+import pymakdaemon
+import pymagarc
 import serial
 import argparse
 import sys
 import glob
+import itertools
+import os
+import re
+import signal
+import sqlite3
 
 def parse_args():
     agp = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter, description="abc\ndef", epilog="ghi\njkl")
@@ -16,7 +25,7 @@ def parse_args():
     #description
     agp_mx1 = agp.add_mutually_exclusive_group(required=True)
     agp_mx1.add_argument("-r", "--read", help="Read data from card", action='store_true')
-    agp_mx1.add_argument("-w", "--write", help="Write data to card", action='store_true')
+    agp_mx1.add_argument("-w", "--write", help="Write data to card (experimental, untested on real readers)", action='store_true')
     agp_mx1.add_argument("-f", "--format", help="Format track for n seconds", type=int)
     agp_mx1.add_argument("-er", "--eepromread", help="Read data item n from eeprom", type=int)
     agp_mx1.add_argument("-era" "--eepromreadall", help="Read all data from eeprom", action='store_true')
@@ -25,7 +34,8 @@ def parse_args():
     agp_mx1.add_argument("-R", "--eRase", help="Wipe card in reverse direction for n seconds", type=int)
     #copy command using buffers here?
     agp.add_argument("-t", "--track", help="Track number for enc/dec operation, defaults to 2", type=int, default=2)
-    agp.add_argument("-p", "--port", help="Port reader is connected to, defaults to /dev/ttyUSB0", type=str)
+    agp.add_argument("-p", "--port", help="Port reader is connected to, defaults to /dev/ttyUSB0\n"
+                                           "a comma separated list reads from several readers at once", type=str)
     #read only
     agp.add_argument("-e", "--extended", help="Extended filename for csv data", type=str)
     #write only
@@ -35,15 +45,24 @@ def parse_args():
                                               "NONE - r - do not use encoded/decoded data stream (default)\n"
                                               "RAW - r/w - use raw timing data\n"
                                               "F2FRAW - r/w - use raw F2F bitstream\n"
+                                              "F2FRAWA - r - use raw F2F bitstream with adaptive clock recovery\n"
                                               "FHFRAW - r/w - use raw FHF bitstream\n"
                                               "F2FT1V - r/w - use F2F bitstream only on T1 LRC integrity check\n"
                                               "F2FT23V - r/w - use F2F bitstream on T2 or T3 LRC integrity check\n"
                                               "P1V - r/w - use F2F bitstream only on P1 integrity check\n"
+                                              "P1VA - r - as P1V with adaptive clock recovery, trying the swipe backwards when forward fails\n"
                                               "P2V - r/w - use FHF bitstream only on P2 integrity check\n", type=str, default="NONE")    
     agp.add_argument("-d", "--data", help="File to load/save data streams, one per line (requires -ed)", type=str)
     agp_mx2 = agp.add_mutually_exclusive_group()
-    agp_mx2.add_argument("-s", "--save", help="Save raw swipe data to SAVE-X.MAG, where X is incremental", type=str)
-    agp_mx2.add_argument("-l", "--load", help="Load raw swipe data from .MAG file", nargs="*", type=str)
+    agp_mx2.add_argument("-s", "--save", help="Save raw swipe data to SAVE-X.MAG, where X is incremental,\n"
+                                              "or append it to SAVE when it ends with .pma", type=str)
+    agp_mx2.add_argument("-l", "--load", help="Load raw swipe data from .MAG files, .PMA archives, directories or glob patterns", nargs="*", type=str)
+    agp.add_argument("-k", "--skip-errors", help="Report and skip .MAG files that fail to load (requires -l)", action='store_true')
+    agp.add_argument("-c", "--cache", help="Keep a decode cache next to loaded .MAG files (requires -r, -l and -ed)", action='store_true')
+    agp.add_argument("-D", "--daemon", help="Capture into a ring buffer and persist swipes in batches on a writer thread\n"
+                                             "(requires -r with -s or -d, extended fields are saved as NONE)", action='store_true')
+    agp.add_argument("--ring", help="Number of swipes the daemon ring buffer holds, defaults to 1024", type=int, default=1024)
+    agp.add_argument("-j", "--jobs", help="Decode loaded files in n worker processes (requires -r, -l and -ed)", type=int)
     ags = agp.parse_args()
     
     #*when reading, if -l is specified, port should not be used
@@ -90,6 +109,14 @@ def parse_args():
     if ags.write and ags.load and ags.enc_dec != "NONE":
         print("Error: writing allows only load or encoder")
         sys.exit(12)
+    #*raw timing values never read back identical
+    if ags.verify and ags.enc_dec.upper() == "RAW":
+        print("Error: verify not supported for RAW")
+        sys.exit(28)
+    #*encoded writes need data to encode
+    if ags.write and ags.enc_dec != "NONE" and not ags.data:
+        print("Error: writing with encoder requires data")
+        sys.exit(29)
     #*sanity check for track number
     if not 1 <= ags.track <= 3:
         print("Error: invalid track specified")
@@ -98,6 +125,38 @@ def parse_args():
     if ags.enc_dec != "NONE" and (not ags.read and not ags.write):
         print("Error: encoder/decoder valid only for read and write")
         sys.exit(16)
+    #*jobs only allowed when decoding loaded files
+    if ags.jobs != None and (not ags.read or not ags.load or ags.enc_dec == "NONE"):
+        print("Error: jobs requires read, load and decoder")
+        sys.exit(19)
+    #*jobs can't prompt for extended values
+    if ags.jobs != None and ags.extended:
+        print("Error: jobs not allowed with extended")
+        sys.exit(20)
+    #*sanity check for number of jobs
+    if ags.jobs != None and ags.jobs < 1:
+        print("Error: invalid number of jobs specified")
+        sys.exit(21)
+    #*skip errors only applies to loaded files
+    if ags.skip_errors and not ags.load:
+        print("Error: skip errors requires load")
+        sys.exit(22)
+    #*cache only applies when decoding loaded files
+    if ags.cache and (not ags.read or not ags.load or ags.enc_dec == "NONE"):
+        print("Error: cache requires read, load and decoder")
+        sys.exit(23)
+    #*daemon only captures from readers
+    if ags.daemon and (not ags.read or ags.load):
+        print("Error: daemon requires read from a reader")
+        sys.exit(24)
+    #*daemon needs something to persist
+    if ags.daemon and not ags.save and not ags.data:
+        print("Error: daemon requires save or data")
+        sys.exit(25)
+    #*sanity check for ring size
+    if ags.ring < 1:
+        print("Error: invalid ring size specified")
+        sys.exit(26)
     return ags
 
 def init_reader(ags):
@@ -109,6 +168,28 @@ def init_reader(ags):
         sys.exit(14)
     return csource
 
+def init_capture(ags):
+    ags.port = "/dev/ttyUSB0" if not ags.port else ags.port
+    ports = ags.port.split(",")
+    if len(ports) == 1:
+        return pymakint.AsyncPyMAKInt(init_reader(ags)), [None]
+    try:
+        csource = pymakint.PyMAKIntPool(ports, deftracks = ags.track)
+    except serial.SerialException as e:
+        print(e)
+        sys.exit(14)
+    return csource, ports
+
+def capture_items(capture):
+    '''Yield (None, card) pairs from a single reader, passing the error that ends its capture on as an item'''
+    while True:
+        try:
+            yield None, next(capture)
+        except StopIteration:
+            return
+        except Exception as e:
+            yield None, e
+
 def select_decoder(ags):
     if ags.enc_dec == "NONE":
         return None
@@ -116,12 +197,29 @@ def select_decoder(ags):
         return pymagpar.raw_decode
     elif ags.enc_dec.upper() == "F2FRAW":
         return pymagpar.f2f_raw_decode
+    elif ags.enc_dec.upper() == "F2FRAWA":
+        return pymagpar.f2f_adaptive_raw_decode
     elif ags.enc_dec.upper() == "P1V":
         return pymagpar.p1v_decode
+    elif ags.enc_dec.upper() == "P1VA":
+        return pymagpar.p1v_adaptive_decode
     else:
         print("Error: invalid decoder specified")
         sys.exit(15)
 
+def select_encoder(ags):
+    if ags.enc_dec == "NONE":
+        return None
+    elif ags.enc_dec.upper() == "RAW":
+        return pymagpar.raw_encode
+    elif ags.enc_dec.upper() == "F2FRAW":
+        return pymagpar.f2f_raw_encode
+    elif ags.enc_dec.upper() == "P1V":
+        return pymagpar.p1v_encode
+    else:
+        print("Error: invalid encoder specified")
+        sys.exit(15)
+
 def init_extended(ags):
     if not ags.extended:
         return
@@ -164,7 +262,10 @@ def query_extended_val(ags, extdat):
             parvals += [parval]
     return parvals
     
-def save_data(ags, curcard, str_rep, datdat, str_ext, extdat):
+def save_prefix(ags, port):
+    return ags.save + ("-" + os.path.basename(port) if port else "")
+
+def save_data(ags, curcard, str_rep, datdat, str_ext, extdat, port = None):
     if ags.data:
         datdat["handle"].write(str_rep + "\n")
     if ags.extended:
@@ -172,9 +273,71 @@ def save_data(ags, curcard, str_rep, datdat, str_ext, extdat):
         extdat["handle"].write(extsav)
     #-l with -e to save filename as csv param
     #add something that allows -l with -e to prompt/parse when only one card is given for -l
-    if ags.save:
-        curcard.save_file(ags.save + "-" + str(save_data.savecount).zfill(3) + '.mag')
-        save_data.savecount += 1
+    if ags.save and save_data.archive != None:
+        save_data.archive.append(curcard, str_ext, port = port)
+    elif ags.save:
+        curcard.save_file(next_save_name(ags, port), atomic = True)
+
+save_data.archive = None
+
+def next_save_name(ags, port, store = True):
+    savename = save_prefix(ags, port) + "-" + str(save_data.savecount[port]).zfill(3) + '.mag'
+    save_data.savecount[port] += 1
+    if store:
+        save_count_store(ags, port)
+    return savename
+
+def save_count_store(ags, port):
+    '''Atomically record the next save number, before the capture using the current one is written'''
+    pymakint.atomic_write(save_prefix(ags, port) + ".count", (str(save_data.savecount[port]) + "\n").encode())
+
+def save_count_recover(ags, port):
+    '''Find the next save number from the existing capture files, used only when the counter file is missing'''
+    prefix = save_prefix(ags, port)
+    savenum = re.compile(re.escape(os.path.basename(prefix)) + r"-([0-9]+)\.mag")
+    lastnum = 0
+    for fname in glob.iglob(glob.escape(prefix) + "-[0-9]*.mag"):
+        match = savenum.fullmatch(os.path.basename(fname))
+        if match:
+            lastnum = max(lastnum, int(match.group(1)))
+    return lastnum + 1
+
+def persist_batch(ags, batch, decode_func, datdat, extdat):
+    savecards = []
+    saveports = set()
+    for curport, curcard in batch:
+        portinfo = (curport + ": ") if curport else ""
+        if isinstance(curcard, Exception):
+            print(portinfo + str(curcard))
+            continue
+        str_rep = None
+        if decode_func:
+            try:
+                str_rep = decode_func(curcard, ags.track)
+            except TypeError as e:
+                print(portinfo + str(e))
+                continue
+            print(portinfo + str_rep)
+        if ags.data:
+            datdat["handle"].write(str_rep + "\n")
+        if ags.extended:
+            extdat["handle"].write(",".join(["NONE"] * len(extdat["fields"])) + "\n")
+        if ags.save and save_data.archive != None:
+            save_data.archive.append(curcard, port = curport)
+        elif ags.save:
+            savecards += [(next_save_name(ags, curport, store = False), curcard)]
+            saveports.add(curport)
+    #Counters move past the whole batch before its captures are written, then everything is synced in one pass
+    for curport in saveports:
+        save_count_store(ags, curport)
+    for savename, curcard in savecards:
+        curcard.save_file(savename, atomic = True, sync = False)
+    pymakint.sync_files([ x[0] for x in savecards ])
+    for fileh in [ x["handle"] for x in (datdat, extdat) if x ]:
+        fileh.flush()
+        os.fsync(fileh.fileno())
+    if ags.save and save_data.archive != None:
+        save_data.archive.sync()
     
 def init_data(ags):
     if not ags.data:
@@ -191,29 +354,144 @@ def init_data(ags):
     datdat["linecount"] = len(readdat)
     return datdat
 
-def save_count_init(ags):
+def expand_load(ags):
+    for inparg in ags.load:
+        if os.path.isdir(inparg):
+            yield from sorted(glob.iglob(os.path.join(glob.escape(inparg), "*.mag")))
+        elif glob.has_magic(inparg):
+            yield from sorted(glob.iglob(inparg))
+        else:
+            yield inparg
+
+def load_cards(ags):
+    for inpfile in expand_load(ags):
+        try:
+            if inpfile[-4:] == ".pma":
+                archive = pymagarc.PyMAGArchive(inpfile, readonly = True)
+            else:
+                curcard = pymakint.PyMAKDat(inpfile)
+        except (ValueError, OSError) as e:
+            if not ags.skip_errors:
+                print(e)
+                sys.exit(17)
+            print(inpfile + ": " + str(e))
+            continue
+        if inpfile[-4:] == ".pma":
+            with archive:
+                yield from archive
+        else:
+            yield curcard
+
+def save_count_init(ags, ports = [None], extdat = None):
     if not ags.save:
         return
-    flist = glob.glob(ags.save + "-*.mag")
-    if not flist:
-        save_data.savecount = 1
-    else:
-        flist.sort(reverse=True)
-        save_data.savecount = int(flist[0][-7:-4:]) + 1
-        print("Continuing save from: " + str(save_data.savecount))
+    save_data.archive = None
+    if ags.save[-4:] == ".pma":
+        try:
+            save_data.archive = pymagarc.PyMAGArchive(ags.save, extdat["fields"] if extdat else None)
+        except (ValueError, OSError) as e:
+            print(e)
+            sys.exit(27)
+        print("Appending to archive with " + str(len(save_data.archive)) + " captures")
+        return
+    save_data.savecount = {}
+    for port in ports:
+        try:
+            with open(save_prefix(ags, port) + ".count", "r") as fileh:
+                save_data.savecount[port] = int(fileh.read())
+        except (OSError, ValueError):
+            save_data.savecount[port] = save_count_recover(ags, port)
+            save_count_store(ags, port)
+        if save_data.savecount[port] > 1:
+            print("Continuing save " + ((port + " ") if port else "") + "from: " + str(save_data.savecount[port]))
+
+def save_close(ags):
+    if ags.save and save_data.archive != None:
+        save_data.archive.close()
+
+def init_cache(ags, inpfiles):
+    if not ags.cache:
+        return None, inpfiles
+    firstfile = next(inpfiles, None)
+    if firstfile == None:
+        return None, inpfiles
+    inpfiles = itertools.chain([firstfile], inpfiles)
+    try:
+        cache = pymagcache.PyMAGCache(os.path.join(os.path.dirname(firstfile), pymagcache.PyMAGCache.CACHENAME))
+    except sqlite3.Error as e:
+        print("Decode cache disabled: " + str(e))
+        cache = None
+    return cache, inpfiles
+
+def command_read_bulk(ags):
+    exitcode = 0
+    datdat = init_data(ags)
+    decode_func = select_decoder(ags)
+    cache, inpfiles = init_cache(ags, expand_load(ags))
+    try:
+        for inpfile, str_rep, str_err, loadfail in pymagbulk.bulk_decode(inpfiles, decode_func, ags.track, workers = ags.jobs if ags.jobs else 0, cache = cache):
+            if loadfail and not ags.skip_errors:
+                print(str_err)
+                exitcode = 17
+                break
+            if str_err != None:
+                print(inpfile + ": " + str_err)
+                continue
+            print(str_rep)
+            if ags.data:
+                datdat["handle"].write(str_rep + "\n")
+    except KeyboardInterrupt:
+        pass
+    if cache:
+        cache.close()
+    if datdat:
+        datdat["handle"].close()
+    if exitcode:
+        sys.exit(exitcode)
+
+def command_read_daemon(ags):
+    extdat = init_extended(ags)
+    datdat = init_data(ags)
+    capture, ports = init_capture(ags)
+    save_count_init(ags, ports, extdat)
+    decode_func = select_decoder(ags)
+    csource = capture if ports != [None] else capture_items(capture)
+    daemon = pymakdaemon.CaptureDaemon(csource, lambda x: persist_batch(ags, x, decode_func, datdat, extdat), ringsize = ags.ring,
+                                       onerror = lambda x: capture.close())
+    signal.signal(signal.SIGUSR1, lambda signum, frame: print(daemon.format_stats()))
+    print("Capturing cards, press CTRL-C to quit, send SIGUSR1 for statistics")
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    capture.close()
+    print(daemon.format_stats())
+    save_close(ags)
+    if extdat:
+        extdat["handle"].close()
+    if datdat:
+        datdat["handle"].close()
+    if daemon.get_error():
+        print("Error: persisting captures failed: " + str(daemon.get_error()))
+        sys.exit(30)
 
 def command_read(ags):
 
+    if ags.daemon:
+        command_read_daemon(ags)
+        return
+
+    if ags.load and not ags.extended and (ags.jobs or ags.cache) and not [ x for x in ags.load if x[-4:] == ".pma" ]:
+        command_read_bulk(ags)
+        return
+
+    capture = None
+    ports = [None]
     if ags.load:
-        try:
-            csource = []
-            for inpfile in ags.load:
-                csource += [pymakint.PyMAKDat(inpfile)]
-        except ValueError as e:
-            print(e)
-            sys.exit(17)
+        csource = zip(itertools.repeat(None), load_cards(ags))
     else:
-        csource = init_reader(ags)
+        capture, ports = init_capture(ags)
+        csource = capture if ports != [None] else capture_items(capture)
     
     extdat = None
     datdat = None
@@ -223,7 +501,7 @@ def command_read(ags):
     try:
         extdat = init_extended(ags)
         datdat = init_data(ags)
-        save_count_init(ags)
+        save_count_init(ags, ports, extdat)
     
         if ags.data and ags.extended:
             if extdat["linecount"] != datdat["linecount"]:
@@ -237,26 +515,96 @@ def command_read(ags):
         print("Reading cards, press CTRL-D/C to quit")
         
         cursave = 0
-        for curcard in csource:
+        for curport, curcard in csource:
             print("Swype next card")
+            portinfo = (curport + ": ") if curport else ""
+            if isinstance(curcard, Exception):
+                print(portinfo + str(curcard))
+                continue
             if decode_func:
                 try:
                     str_rep = decode_func(curcard, ags.track)
                 except TypeError as e:
-                    print(e)
+                    print(portinfo + str(e))
                     continue
-                print(str_rep)
+                print(portinfo + str_rep)
             str_ext = query_extended_val(ags, extdat)
-            save_data(ags, curcard, str_rep, datdat, str_ext, extdat)
+            save_data(ags, curcard, str_rep, datdat, str_ext, extdat, curport)
     except (KeyboardInterrupt, EOFError):
         pass
+    if capture:
+        capture.close()
+    save_close(ags)
     if extdat:
         extdat["handle"].close()
     if datdat:
         datdat["handle"].close()        
     
+def write_cards(ags, encode_func):
+    '''Yield (data line, card) pairs to write, encoding each line of the data file or passing loaded cards through'''
+    if ags.load:
+        yield from zip(itertools.repeat(None), load_cards(ags))
+        return
+    try:
+        inpfile = open(ags.data, "r")
+    except OSError as e:
+        print(e)
+        sys.exit(17)
+    with inpfile:
+        for curline in inpfile:
+            str_rep = curline.strip()
+            if not str_rep:
+                continue
+            curcard = pymakint.PyMAKDat()
+            try:
+                encode_func(curcard, ags.track, str_rep)
+            except (TypeError, ValueError) as e:
+                print(str_rep + ": " + str(e))
+                continue
+            yield str_rep, curcard
+
+def verify_card(ags, csource, decode_func, str_rep):
+    '''Read the written card back and compare its decoded data with the data line'''
+    print("Swype card again to verify")
+    try:
+        str_dec = decode_func(csource.read_tracks_raw(), ags.track)
+    except (serial.SerialException, TypeError) as e:
+        print("Verify failed: " + str(e))
+        return False
+    #Readers add their own clocking zeros around a raw bitstream
+    if (str_rep.strip("0") in str_dec) if ags.enc_dec.upper() == "F2FRAW" else (str_dec == str_rep):
+        print("Verified")
+        return True
+    print("Verify failed: " + str_dec)
+    return False
+
 def command_write(ags):
-    pass
+    encode_func = select_encoder(ags)
+    decode_func = select_decoder(ags) if ags.verify else None
+    csource = init_reader(ags)
+    written = 0
+    failed = 0
+
+    print("Writing cards, press CTRL-C to quit")
+
+    try:
+        for str_rep, curcard in write_cards(ags, encode_func):
+            if str_rep:
+                print(str_rep)
+            print("Swype next card to write")
+            try:
+                csource.write_tracks_raw(curcard)
+            except (serial.SerialException, ValueError) as e:
+                print(e)
+                failed += 1
+                continue
+            if decode_func and not verify_card(ags, csource, decode_func, str_rep):
+                failed += 1
+                continue
+            written += 1
+    except KeyboardInterrupt:
+        pass
+    print("Written " + str(written) + " cards, " + str(failed) + " failed")
 
 def command_format(ags):
     init_reader(ags)
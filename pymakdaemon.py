@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import collections
+import threading
+
+class FrameRing:
+
+    def __init__(self, size = 1024):
+        '''Bounded ring of captured frames, the oldest frame is dropped when a push finds it full'''
+        self._frames = collections.deque(maxlen = size)
+        self._cond = threading.Condition()
+        self._pushed = 0
+        self._dropped = 0
+
+    def push(self, frame):
+        '''Append a frame, dropping the oldest one if the ring is full'''
+        with self._cond:
+            if len(self._frames) == self._frames.maxlen:
+                self._dropped += 1
+            self._frames.append(frame)
+            self._pushed += 1
+            self._cond.notify()
+
+    def drain(self, maxcount, timeout = None):
+        '''Wait up to timeout for a frame and return up to maxcount frames, oldest first'''
+        with self._cond:
+            if not self._frames:
+                self._cond.wait(timeout)
+            return [ self._frames.popleft() for x in range(min(maxcount, len(self._frames))) ]
+
+    def wakeup(self):
+        '''Wake every thread waiting in drain'''
+        with self._cond:
+            self._cond.notify_all()
+
+    def get_depth(self):
+        '''Return the number of frames waiting to be drained'''
+        return len(self._frames)
+
+    def get_pushed(self):
+        '''Return the number of frames pushed so far'''
+        return self._pushed
+
+    def get_dropped(self):
+        '''Return the number of frames dropped because the ring was full'''
+        return self._dropped
+
+
+class CaptureDaemon:
+
+    def __init__(self, source, persist, ringsize = 1024, batchsize = 64, flushinterval = 0.5, onerror = None):
+        '''Move frames from source into a ring buffer and hand them in batches to persist on a writer thread,
+           a failing persist stops the writer and calls onerror so the source can be closed'''
+        self._source = source
+        self._persist = persist
+        self._ring = FrameRing(ringsize)
+        self._batchsize = batchsize
+        self._flushinterval = flushinterval
+        self._onerror = onerror
+        self._stopevent = threading.Event()
+        self._written = 0
+        self._batches = 0
+        self._failed = 0
+        self._error = None
+        self._writer = threading.Thread(target = self._write_loop, daemon = True)
+
+    def _write_loop(self):
+        '''Drain the ring into persist until capture stops and the ring is empty, or persist fails'''
+        while not self._stopevent.is_set() or self._ring.get_depth():
+            batch = self._ring.drain(self._batchsize, self._flushinterval)
+            if not batch:
+                continue
+            try:
+                self._persist(batch)
+            except Exception as e:
+                #A batch may be partly persisted, retrying could duplicate it so capture is stopped instead
+                self._failed += len(batch)
+                self._error = e
+                if self._onerror:
+                    self._onerror(e)
+                return
+            self._written += len(batch)
+            self._batches += 1
+
+    def run(self):
+        '''Capture until the source ends, is interrupted or persisting fails, then flush everything still buffered'''
+        self._writer.start()
+        try:
+            for frame in self._source:
+                if self._error:
+                    break
+                self._ring.push(frame)
+        finally:
+            self._stopevent.set()
+            self._ring.wakeup()
+            self._writer.join()
+
+    def get_error(self):
+        '''Return the exception that stopped persisting, or None'''
+        return self._error
+
+    def get_stats(self):
+        '''Return the capture, drop, write, failure and queue depth counters'''
+        return {"captured": self._ring.get_pushed(), "dropped": self._ring.get_dropped(),
+                "written": self._written, "batches": self._batches, "failed": self._failed, "depth": self._ring.get_depth()}
+
+    def format_stats(self):
+        '''Return the counters as a single printable line'''
+        return ", ".join([ x + ": " + str(y) for x, y in self.get_stats().items() ])
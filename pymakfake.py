@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import pymakint
+import argparse
+import collections
+import os
+import pty
+import select
+import threading
+import time
+import tty
+
+class FakeMSUSB:
+
+    VERSION = b'MSUSB CZ.090211'
+
+    def __init__(self, cards, swipedelay = 0.1):
+        '''Emulate a reader on a pseudo terminal, answering ? and R and swiping the next card for every R,
+        a card written with W is swiped before the others'''
+        self._cards = iter(cards)
+        self._written = collections.deque()
+        self._swipedelay = swipedelay
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self._portname = os.ttyname(self._slave)
+        self._stopevent = threading.Event()
+        self._thread = threading.Thread(target = self._serve, daemon = True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _serve(self):
+        while not self._stopevent.is_set():
+            try:
+                if not select.select([self._master], [], [], 0.1)[0]:
+                    continue
+                command = os.read(self._master, 1)
+                if command == b'?':
+                    os.write(self._master, FakeMSUSB.VERSION)
+                elif command == b'R':
+                    os.read(self._master, 1)
+                    os.write(self._master, b'Ready')
+                    curcard = self._written.popleft() if self._written else next(self._cards, None)
+                    if curcard is None:
+                        continue
+                    time.sleep(self._swipedelay)
+                    os.write(self._master, FakeMSUSB.frame(curcard))
+                elif command == b'W':
+                    os.read(self._master, 1)
+                    os.write(self._master, b'Ready')
+                    header = self._read_exact(5)
+                    tickcount = (header[3] << 8) + header[4]
+                    rawdata = self._read_exact((tickcount * 2) + (2 if (tickcount % 2) != 0 else 0))[:tickcount*2]
+                    time.sleep(self._swipedelay)
+                    self._written.append(rawdata)
+                    os.write(self._master, b'WD=OK')
+            except OSError:
+                return
+
+    def _read_exact(self, count):
+        readbytes = b''
+        while len(readbytes) < count:
+            readbytes += os.read(self._master, count - len(readbytes))
+        return readbytes
+
+    @staticmethod
+    def frame(curcard):
+        '''Build the reader response for a card given as PyMAKDat, raw data or .mag file name'''
+        if isinstance(curcard, str):
+            curcard = pymakint.PyMAKDat(curcard)
+        rawdata = bytes(curcard._rawdata if isinstance(curcard, pymakint.PyMAKDat) else curcard)
+        tickcount = len(rawdata) // 2
+        padding = b'\x00\x00' if (tickcount % 2) != 0 else b''
+        return b'RD ' + bytes([tickcount >> 8, tickcount & 0xFF]) + rawdata + padding + b'RD=OK'
+
+    def get_port(self):
+        '''Return the name of the port to open with PyMAKInt'''
+        return self._portname
+
+    def close(self):
+        '''Stop serving and close the pseudo terminal once nothing can write to it any more'''
+        self._stopevent.set()
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+if __name__ == '__main__':
+
+    agp = argparse.ArgumentParser(description="Serve .mag captures from fake readers on pseudo terminals")
+    agp.add_argument("files", help=".MAG files to swipe, in order", nargs="+", type=str)
+    agp.add_argument("-c", "--count", help="Number of fake readers, files are dealt round robin", type=int, default=1)
+    agp.add_argument("-d", "--delay", help="Seconds between arming a reader and the swipe", type=float, default=1)
+    ags = agp.parse_args()
+
+    readers = [ FakeMSUSB(ags.files[x::ags.count], swipedelay = ags.delay) for x in range(ags.count) ]
+    print(",".join([ x.get_port() for x in readers ]))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
@@ -2,8 +2,59 @@
 
 import serial
 import struct
+import asyncio
+import queue
+import threading
 import math
+import array
+import mmap
 import os
+import tempfile
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#The umask can only be read by setting it, so do it once at import before any threads start
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def atomic_write(outputfile, filedata, sync = True):
+    '''Write a file through a temporary file renamed over it, with the mode a plain open would leave,
+       synced before the rename unless the caller syncs a batch of files later with sync_files'''
+    try:
+        filemode = os.stat(outputfile).st_mode & 0o7777
+    except FileNotFoundError:
+        filemode = 0o666 & ~_UMASK
+    tmpfd, tmpname = tempfile.mkstemp(suffix = ".tmp", dir = os.path.dirname(os.path.abspath(outputfile)))
+    try:
+        os.fchmod(tmpfd, filemode)
+        with os.fdopen(tmpfd, "wb") as fileh:
+            fileh.write(filedata)
+            if sync:
+                fileh.flush()
+                os.fsync(fileh.fileno())
+        os.replace(tmpname, outputfile)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+
+def sync_files(outputfiles):
+    '''Sync the data of written files and then, once each, the directories holding them'''
+    for outputfile in outputfiles:
+        filefd = os.open(outputfile, os.O_RDONLY)
+        try:
+            os.fsync(filefd)
+        finally:
+            os.close(filefd)
+    for dirname in set([ os.path.dirname(os.path.abspath(x)) for x in outputfiles ]):
+        dirfd = os.open(dirname, os.O_RDONLY)
+        try:
+            os.fsync(dirfd)
+        finally:
+            os.close(dirfd)
 
 class PyMAKInt:
     
@@ -16,6 +67,7 @@ class PyMAKInt:
         '''Open the default USB port and check reader version, tested on MSUSB CZ.090211'''
         self._portname = port
         self._defracks = deftracks
+        self._lastlatency = None
         try:
             self._serialobj = serial.Serial(port, 38400, timeout = 1)
         except serial.serialutil.SerialException:
@@ -30,6 +82,10 @@ class PyMAKInt:
     def __str__(self):
         print(self._rversion)
 
+    def get_port(self):
+        '''Return the name of the port the reader is connected to'''
+        return self._portname
+
     def __iter__(self):
         return self
         
@@ -58,21 +114,52 @@ class PyMAKInt:
             raise serial.SerialException('Card read timeout occurred')
         elif readbytes != b'RD ':
             raise serial.SerialException('Invalid data from reader')
+        capturetime = time.perf_counter()
         self._serialobj.timeout = 1
         readbytes = self._serialobj.read(2)
+        if len(readbytes) != 2:
+            raise serial.SerialException('Error, data alignment problem')
         tickcount = (readbytes[0] << 8) + readbytes[1]
         ticksbytes = (tickcount * 2) + (2 if (tickcount % 2) != 0 else 0)
-        databytes = self._serialobj.read(ticksbytes)
-        readbytes = self._serialobj.read(5)
-        if readbytes != b'RD=OK':
+        framebuf = bytearray(ticksbytes + 5)
+        frameview = memoryview(framebuf)
+        if self._serialobj.readinto(framebuf) != len(framebuf) or frameview[ticksbytes:] != b'RD=OK':
             raise serial.SerialException('Error, data alignment problem')
-        return PyMAKDat(list(databytes[0:tickcount*2]))
+        cdat = PyMAKDat(frameview[0:tickcount*2])
+        self._lastlatency = time.perf_counter() - capturetime
+        return cdat
+    
+    def get_last_latency(self):
+        '''Return the seconds between the start of the last swipe frame and its PyMAKDat being ready'''
+        return self._lastlatency
     
     #def read_into_buffer(self, tracks = TRACK1 | TRACK2 | TRACK3, timeout = 30)
     #    pass
     
-    #def write_tracks_raw(self, data):
-    #    pass
+    def write_tracks_raw(self, cdat, tracks = None, timeout = 30):
+        '''Experimental, wait for a card swype and write the raw tick data of a PyMAKDat to it'''
+        #The MSUSB write command is undocumented, this framing mirrors read_tracks_raw (W+tracks, Ready, WD + count + ticks,
+        #WD=OK) and has only been exercised against pymakfake, not against a real reader
+        tracks =  tracks if tracks else self._defracks
+        if (tracks & ~(PyMAKInt.TRACK1 | PyMAKInt.TRACK2 | PyMAKInt.TRACK3)) != 0 or \
+            (tracks & (PyMAKInt.TRACK1 | PyMAKInt.TRACK2 | PyMAKInt.TRACK3)) == 0:
+            raise ValueError('Invalid track specified')
+        rawdata = cdat.get_raw_data()
+        tickcount = len(rawdata) // 2
+        if tickcount > 0xFFFF:
+            raise ValueError('Raw data too long')
+        self._serialobj.timeout = 1
+        self._serialobj.write(b'W' + bytes([tracks]))
+        readbytes = self._serialobj.read(5)
+        if readbytes != b'Ready':
+            raise serial.SerialException('Error initialising card write')
+        self._serialobj.write(b'WD ' + bytes([tickcount >> 8, tickcount & 0xFF]) + rawdata + (b'\x00\x00' if (tickcount % 2) != 0 else b''))
+        self._serialobj.timeout = timeout
+        readbytes = self._serialobj.read(5)
+        if readbytes == b'':
+            raise serial.SerialException('Card write timeout occurred')
+        elif readbytes != b'WD=OK':
+            raise serial.SerialException('Error card write failure')
     
     #def reset_reader(self)
     #    pass
@@ -140,102 +227,422 @@ class PyMAKInt:
         elif erres != b'EZ=OK':
             raise serial.SerialException('Error, invalid confirmation from device')
 
+    def cancel_read(self):
+        '''Make a read waiting on another thread return early, as if it timed out'''
+        self._serialobj.cancel_read()
+
+    def close(self):
+        '''Close the serial port'''
+        self._serialobj.close()
+
+
+class AsyncPyMAKInt:
+    
+    def __init__(self, reader, tracks = None, timeout = 30, maxqueue = 64, cardqueue = None):
+        '''Capture swipes from a PyMAKInt on a dedicated thread, re-arming the reader as soon as a swipe arrives,
+           when a shared cardqueue is given items are put on it as (port, item) pairs instead'''
+        self._reader = reader
+        self._tracks = tracks
+        self._timeout = timeout
+        self._porttag = reader.get_port() if cardqueue else None
+        self._cardqueue = cardqueue if cardqueue else queue.Queue(maxqueue)
+        self._stopevent = threading.Event()
+        self._thread = threading.Thread(target = self._capture_loop, daemon = True)
+        self._thread.start()
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        return self._unpack(self._cardqueue.get())
+    
+    def __aiter__(self):
+        return self
+    
+    async def __anext__(self):
+        try:
+            return self._unpack(await asyncio.get_running_loop().run_in_executor(None, self._cardqueue.get))
+        except StopIteration:
+            raise StopAsyncIteration
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def _capture_loop(self):
+        '''Read swipes until stopped, queueing cards and the first error, always ending with the None sentinel'''
+        try:
+            while not self._stopevent.is_set():
+                try:
+                    cdat = self._reader.read_tracks_raw(self._tracks, self._timeout)
+                except serial.SerialException as e:
+                    #A read cancelled by close fails wherever it was interrupted, that is not a reader error
+                    if self._stopevent.is_set():
+                        break
+                    if str(e) == "Card read timeout occurred":
+                        continue
+                    self._put(e)
+                    break
+                self._put(cdat)
+        except Exception as e:
+            #A malformed frame fails in PyMAKDat, hand it to the consumer to re-raise
+            self._put(e)
+        finally:
+            self._put(None)
+    
+    def _put(self, item):
+        '''Queue an item, once closed a full queue no one drains any more drops it instead of blocking'''
+        item = (self._porttag, item) if self._porttag else item
+        while True:
+            try:
+                self._cardqueue.put(item, timeout = 0.1)
+                return
+            except queue.Full:
+                if self._stopevent.is_set():
+                    return
+    
+    def _unpack(self, item):
+        if item is None:
+            self._cardqueue.put(None)
+            raise StopIteration
+        if isinstance(item, Exception):
+            raise item
+        return item
+    
+    def pending(self):
+        '''Return the number of captured swipes not yet consumed'''
+        return self._cardqueue.qsize()
+    
+    def close(self):
+        '''Stop capturing, cancelling the read in progress, and close the reader once the capture thread has ended'''
+        self._stopevent.set()
+        self._reader.cancel_read()
+        self._thread.join()
+        self._reader.close()
+
+
+class PyMAKIntPool:
+    
+    def __init__(self, ports, deftracks = (PyMAKInt.TRACK1 | PyMAKInt.TRACK2 | PyMAKInt.TRACK3), timeout = 30, maxqueue = 64):
+        '''Open a reader on every port and merge their swipes, in arrival order, into one stream of (port, card) pairs'''
+        self._cardqueue = queue.Queue(maxqueue)
+        self._capturers = []
+        for port in ports:
+            try:
+                reader = PyMAKInt(port = port, deftracks = deftracks)
+            except serial.SerialException as e:
+                self.close()
+                raise serial.SerialException(port + ": " + str(e))
+            self._capturers += [AsyncPyMAKInt(reader, timeout = timeout, cardqueue = self._cardqueue)]
+        self._running = len(self._capturers)
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        '''Return the next (port, card) pair, a failing reader yields (port, exception) once and stops'''
+        nextitem = self._next_item()
+        if nextitem is None:
+            raise StopIteration
+        return nextitem
+    
+    def __aiter__(self):
+        return self
+    
+    async def __anext__(self):
+        nextitem = await asyncio.get_running_loop().run_in_executor(None, self._next_item)
+        if nextitem is None:
+            raise StopAsyncIteration
+        return nextitem
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def _next_item(self):
+        while self._running:
+            port, item = self._cardqueue.get()
+            if item is None:
+                self._running -= 1
+                continue
+            return port, item
+        return None
+    
+    def get_ports(self):
+        '''Return the ports of all readers in the pool'''
+        return [ x._reader.get_port() for x in self._capturers ]
+    
+    def pending(self):
+        '''Return the number of captured swipes not yet consumed'''
+        return self._cardqueue.qsize()
+    
+    def close(self):
+        '''Stop capturing on all readers and close them'''
+        for capturer in self._capturers:
+            capturer.close()
+
 
 class PyMAKDat:
     
-    def __init__(self, data = None):
-        self._rawtracktiming = [[], [], []]
+    __slots__ = ("_engine", "_rawdata", "_rawtracktiming")
+    
+    ENGINE_LIST = "list"
+    ENGINE_NUMPY = "numpy"
+    
+    _MAGRECORD = numpy.dtype([("mask", numpy.intc), ("time", numpy.single)]) if numpy is not None else None
+    _RAWTYPE = list
+    _TICKBYTES = bytes([ x for x in range(256) if not x & ~(PyMAKInt.TRACK1 | PyMAKInt.TRACK2 | PyMAKInt.TRACK3 | PyMAKInt.CHARB7) ])
+    
+    def __init__(self, data = None, engine = ENGINE_LIST):
+        if engine not in (PyMAKDat.ENGINE_LIST, PyMAKDat.ENGINE_NUMPY):
+            raise ValueError("Invalid timing engine specified")
+        if engine == PyMAKDat.ENGINE_NUMPY and numpy is None:
+            raise ValueError("NumPy timing engine requires numpy")
+        self._engine = engine
+        self._rawdata = None
+        self._rawtracktiming = [None, None, None]
         if isinstance(data, str):
             self._load_file(data)
-        elif isinstance(data, list):
-            self._rawdata = data
-        self._calc_raw_timing()
+        elif isinstance(data, (list, bytes, bytearray, memoryview)):
+            self._set_raw_data(data)
                     
     def __str__(self):
         retstr = str()
-        for tracknum in range(3):
-            for trackval in range(len(self._rawtracktiming[tracknum])):
-                retstr += str(self._rawtracktiming[tracknum][trackval]) + " "
+        for track in (PyMAKInt.TRACK1, PyMAKInt.TRACK2, PyMAKInt.TRACK3):
+            for trackval in self.get_raw_track_timing(track):
+                retstr += str(trackval) + " "
             retstr += "\n"
         return retstr
     
-    def _calc_raw_timing(self):
-        '''Calculate the interval between ticks for all tracks'''
-        if self._rawdata != None:
-            if len(self._rawdata) % 2 != 0:
-                raise ValueError("Raw data length mismatch")
-            tracktiming = [0, 0, 0]
-            trackstate = [False, False, False]
-            trackstate[0] = bool(self._rawdata[1] & PyMAKInt.TRACK1)
-            trackstate[1] = bool(self._rawdata[1] & PyMAKInt.TRACK2)
-            trackstate[2] = bool(self._rawdata[1] & PyMAKInt.TRACK3)
-            for curtick in range(2, len(self._rawdata), 2):
-                timingvalue = self._rawdata[curtick-2] + ((self._rawdata[curtick-1] & PyMAKInt.CHARB7) << 1)
-                maskvalue = self._rawdata[curtick+1] & (PyMAKInt.TRACK1 | PyMAKInt.TRACK2 | PyMAKInt.TRACK3)
-                if bool(self._rawdata[curtick+1] & ~(PyMAKInt.TRACK1 | PyMAKInt.TRACK2 | PyMAKInt.TRACK3 | PyMAKInt.CHARB7)):
-                    raise ValueError("Error parsing tick transition")
-                for i in range(3):
-                    tracktiming[i] += timingvalue
-                    if trackstate[i] != bool(maskvalue & pow(2, i)):
-                        self._rawtracktiming[i] += [tracktiming[i]]
-                        trackstate[i] = not trackstate[i]
-                        tracktiming[i] = 0
-            for i in range(3):
-                if len(self._rawtracktiming[i]) < 10:
-                    self._rawtracktiming[i] = []
+    def _set_raw_data(self, rawdata):
+        '''Replace the raw tick data, check the transition bytes and drop any cached track timing'''
+        if len(rawdata) % 2 != 0:
+            raise ValueError("Raw data length mismatch")
+        if len(rawdata) < 2:
+            raise ValueError("Raw data holds no ticks")
+        try:
+            badticks = bytes(rawdata[3::2]).translate(None, PyMAKDat._TICKBYTES)
+        except ValueError:
+            badticks = True
+        if badticks:
+            raise ValueError("Error parsing tick transition")
+        self._rawdata = rawdata
+        self._rawtracktiming = [None, None, None]
+    
+    def _calc_raw_timing(self, tracknum):
+        '''Calculate the interval between ticks for a single track'''
+        if self._rawdata == None:
+            return []
+        if self._engine == PyMAKDat.ENGINE_NUMPY:
+            return self._calc_raw_timing_numpy(tracknum)
+        trackmask = 1 << tracknum
+        rawtiming = []
+        tracktiming = 0
+        trackstate = self._rawdata[1] & trackmask
+        for curtick in range(2, len(self._rawdata), 2):
+            tracktiming += self._rawdata[curtick-2] + ((self._rawdata[curtick-1] & PyMAKInt.CHARB7) << 1)
+            if (self._rawdata[curtick+1] & trackmask) != trackstate:
+                rawtiming.append(tracktiming)
+                trackstate ^= trackmask
+                tracktiming = 0
+        return rawtiming if len(rawtiming) >= 10 else []
+    
+    def _calc_raw_timing_numpy(self, tracknum):
+        '''Calculate the interval between ticks for a single track in one pass over the raw buffer'''
+        rawarr = self._raw_array()
+        elapsed = numpy.cumsum(rawarr[0:-2:2] + ((rawarr[1:-2:2] & PyMAKInt.CHARB7) << 1))
+        trackstate = (rawarr[1::2] >> tracknum) & 1
+        transitions = numpy.flatnonzero(trackstate[1:] != trackstate[:-1])
+        rawtiming = numpy.diff(elapsed[transitions], prepend = 0)
+        return rawtiming if len(rawtiming) >= 10 else rawtiming[:0]
         
     def _load_file(self, inputfile):
         '''Load the data from a .mag compatible file'''
         if inputfile[-4:] != ".mag":
             raise ValueError("Filename must end with a .mag extension")
-        fileh = open(inputfile, "rb")
-        tcount = struct.unpack("i", fileh.read(4))[0]
-        if os.path.getsize(inputfile) != (4 + (tcount*2*4)):
+        with open(inputfile, "rb") as fileh:
+            filesize = os.fstat(fileh.fileno()).st_size
+            if filesize < 4:
+                raise ValueError("Error parsing input file, length mismatch")
+            filemap = mmap.mmap(fileh.fileno(), 0, access = mmap.ACCESS_READ)
+        tcount = struct.unpack_from("i", filemap)[0]
+        if filesize != (4 + (tcount*2*4)):
             raise ValueError("Error parsing input file, length mismatch")
-        self._rawdata = [0] * ((tcount * 2) + 2)
+        #The map is released along with the last view taken on it
+        if numpy is not None:
+            self._set_raw_data(self._RAWTYPE(PyMAKDat._unpack_records_numpy(filemap, tcount)))
+        else:
+            self._set_raw_data(self._RAWTYPE(PyMAKDat._unpack_records(filemap, tcount)))
+        #Change initial flags to neg of first file flags here?
+    
+    @staticmethod
+    def _unpack_records(filemap, tcount):
+        '''Convert the (mask, time) records of a mapped .mag file into raw tick data'''
+        rawdata = bytearray((tcount * 2) + 2)
         lasttf = float(0)
-        for curtick in range(0, tcount*2, 2):
-            curmask = struct.unpack("i", fileh.read(4))[0] >> 4
+        for curtick, (curmask, newtf) in zip(range(0, tcount*2, 2), struct.iter_unpack("if", memoryview(filemap)[4:])):
+            curmask >>= 4
             if (curmask & ~(PyMAKInt.TRACK1 | PyMAKInt.TRACK2 | PyMAKInt.TRACK3)) != 0:
                 raise ValueError("Error parsing input file, transition mismatch")
-            newtf = struct.unpack("f", fileh.read(4))[0]
             if newtf < lasttf:
                 raise ValueError("Error parsing input file, timing mismatch")
             tdiff = int((newtf - lasttf) * 150)
-            self._rawdata[curtick] += tdiff & 0xFF
-            self._rawdata[curtick+1] += (tdiff >> 1) & PyMAKInt.CHARB7
-            self._rawdata[curtick+3] += curmask
+            rawdata[curtick] = tdiff & 0xFF
+            rawdata[curtick+1] |= (tdiff >> 1) & PyMAKInt.CHARB7
+            rawdata[curtick+3] = curmask
             lasttf = newtf
-        del self._rawdata[-2:]
-        #Change initial flags to neg of first file flags here?
-        fileh.close()        
+        del rawdata[-2:]
+        return rawdata
+    
+    @staticmethod
+    def _unpack_records_numpy(filemap, tcount):
+        '''Convert the (mask, time) records of a mapped .mag file into raw tick data using a structured view'''
+        records = numpy.frombuffer(filemap, dtype = PyMAKDat._MAGRECORD, count = tcount, offset = 4)
+        masks = records["mask"] >> 4
+        if numpy.any(masks & ~(PyMAKInt.TRACK1 | PyMAKInt.TRACK2 | PyMAKInt.TRACK3)):
+            raise ValueError("Error parsing input file, transition mismatch")
+        tdiffs = numpy.diff(records["time"].astype(numpy.float64), prepend = 0.0)
+        if not numpy.all(tdiffs >= 0) or not numpy.all(numpy.isfinite(tdiffs)):
+            raise ValueError("Error parsing input file, timing mismatch")
+        tdiffs = numpy.fmod(numpy.trunc(tdiffs * 150), 512).astype(numpy.int64)
+        rawarr = numpy.empty(tcount * 2, dtype = numpy.uint8)
+        rawarr[0::2] = tdiffs & 0xFF
+        rawarr[1::2] = (tdiffs >> 1) & PyMAKInt.CHARB7
+        rawarr[3::2] |= masks[:-1].astype(numpy.uint8)
+        return rawarr.tobytes()        
         
-    def save_file(self, outputfile):
-        '''Save the data in a .mag compatible file'''
+    def save_file(self, outputfile, atomic = False, sync = True):
+        '''Save the data in a .mag compatible file, optionally through a temporary file and rename that is synced
+           unless sync is False'''
         if outputfile[-4:] != ".mag":
             raise ValueError("Filename must end with a .mag extension")
-        fileh = open(outputfile, "wb")
-        tickcount = int(len(self._rawdata) / 2)
-        self._rawdata += [0x00, 0x00]                                   
-        fileh.write(struct.pack("i", tickcount))                        
+        filedata = self.get_mag_data()
+        if not atomic:
+            with open(outputfile, "wb") as fileh:
+                fileh.write(filedata)
+            return
+        atomic_write(outputfile, filedata, sync)
+    
+    def get_raw_data(self):
+        '''Return the raw tick data as bytes'''
+        return bytes(self._rawdata)
+    
+    def get_mag_data(self):
+        '''Return the contents of a .mag compatible file for the data'''
+        if numpy is not None:
+            return self._pack_records_numpy()
+        return self._pack_records()
+    
+    def _pack_records(self):
+        '''Pack the raw tick data into the contents of a .mag file'''
+        tickcount = len(self._rawdata) // 2
+        filedata = bytearray(4 + (tickcount*2*4))
+        struct.pack_into("i", filedata, 0, tickcount)
         timetotick = float(0)
         for curtick in range(0, tickcount*2, 2):
             timingvalue = self._rawdata[curtick] + (((self._rawdata[curtick+1] & PyMAKInt.CHARB7)) << 1)
-            maskvalue = self._rawdata[curtick+3] & (PyMAKInt.TRACK1 | PyMAKInt.TRACK2 | PyMAKInt.TRACK3)
+            if curtick+3 < len(self._rawdata):
+                maskvalue = self._rawdata[curtick+3] & (PyMAKInt.TRACK1 | PyMAKInt.TRACK2 | PyMAKInt.TRACK3)
+            else:
+                maskvalue = 0
             timetotick += (timingvalue / 150)
-            maskvalue <<= 4
-            fileh.write(struct.pack("i", maskvalue))
-            fileh.write(struct.pack("f", timetotick))
-        del self._rawdata[-2:]
-        fileh.close()
+            struct.pack_into("if", filedata, 4 + (curtick*4), maskvalue << 4, timetotick)
+        return filedata
+    
+    def _pack_records_numpy(self):
+        '''Pack the raw tick data into the contents of a .mag file using a structured view'''
+        tickcount = len(self._rawdata) // 2
+        rawarr = numpy.zeros((tickcount*2) + 2, dtype = numpy.int64)
+        rawarr[:tickcount*2] = self._raw_array()[:tickcount*2]
+        filedata = bytearray(4 + (tickcount*2*4))
+        struct.pack_into("i", filedata, 0, tickcount)
+        records = numpy.frombuffer(filedata, dtype = PyMAKDat._MAGRECORD, count = tickcount, offset = 4)
+        records["mask"] = (rawarr[3::2] & (PyMAKInt.TRACK1 | PyMAKInt.TRACK2 | PyMAKInt.TRACK3)) << 4
+        records["time"] = numpy.cumsum((rawarr[0:-2:2] + ((rawarr[1:-2:2] & PyMAKInt.CHARB7) << 1)) / 150)
+        return filedata
+        
+    def _raw_array(self):
+        '''Return the raw tick data as an integer array'''
+        if isinstance(self._rawdata, (bytes, bytearray, memoryview)):
+            return numpy.frombuffer(self._rawdata, dtype = numpy.uint8).astype(numpy.int64)
+        return numpy.asarray(self._rawdata, dtype = numpy.int64)
         
     def get_raw_track_timing(self, track):
         '''Return the timing values for a given track'''
         if bin(track).count("1") != 1 or (track & ~(PyMAKInt.TRACK1 | PyMAKInt.TRACK2 | PyMAKInt.TRACK3)) != 0:
             raise ValueError('Invalid track specified')
-        return self._rawtracktiming[int(math.log(track, 2))]
+        tracknum = int(math.log(track, 2))
+        if self._rawtracktiming[tracknum] is None:
+            self._rawtracktiming[tracknum] = self._calc_raw_timing(tracknum)
+        return self._rawtracktiming[tracknum]
           
     def set_raw_track_timing(self, track, rawtiming):
-        '''Calculate raw data from timing data'''  
-        '''error checking for max length'''
-        pass    
+        '''Replace the timing values of a track, merging its transitions with those of the other tracks into raw tick data'''
+        if bin(track).count("1") != 1 or (track & ~(PyMAKInt.TRACK1 | PyMAKInt.TRACK2 | PyMAKInt.TRACK3)) != 0:
+            raise ValueError('Invalid track specified')
+        if any(x <= 0 for x in rawtiming):
+            raise ValueError("Invalid timing value")
+        trackmasks = PyMAKInt.TRACK1 | PyMAKInt.TRACK2 | PyMAKInt.TRACK3
+        #Absolute tick time of every transition, mapped to the tracks changing state then
+        toggles = {}
+        startmask = 0
+        if self._rawdata:
+            startmask = self._rawdata[1] & trackmasks
+            lastmask = startmask
+            elapsed = 0
+            for curtick in range(2, len(self._rawdata), 2):
+                elapsed += self._rawdata[curtick-2] + ((self._rawdata[curtick-1] & PyMAKInt.CHARB7) << 1)
+                curmask = self._rawdata[curtick+1] & trackmasks
+                if (curmask ^ lastmask) & ~track:
+                    toggles[elapsed] = (curmask ^ lastmask) & ~track
+                lastmask = curmask
+        elapsed = 0
+        for curtime in rawtiming:
+            elapsed += curtime
+            toggles[elapsed] = toggles.get(elapsed, 0) | track
+        rawdata = bytearray([0, startmask])
+        curmask = startmask
+        lasttime = 0
+        for curtime in sorted(toggles):
+            tdiff = curtime - lasttime
+            #Intervals only hold 9 bits, longer gaps get filler ticks that keep the track state
+            while tdiff > 0x1FF:
+                rawdata[-2] = 0xFF
+                rawdata[-1] |= PyMAKInt.CHARB7
+                rawdata += bytes([0, curmask])
+                tdiff -= 0x1FF
+            rawdata[-2] = tdiff & 0xFF
+            rawdata[-1] |= (tdiff >> 1) & PyMAKInt.CHARB7
+            curmask ^= toggles[curtime]
+            rawdata += bytes([0, curmask])
+            lasttime = curtime
+        if len(rawdata) // 2 > 0xFFFF:
+            raise ValueError("Raw data too long")
+        self._set_raw_data(self._RAWTYPE(rawdata))
+
+
+class PyMAKDatCompact(PyMAKDat):
+    '''PyMAKDat variant that keeps the raw stream as bytes and the track timing as unsigned arrays'''
+    
+    __slots__ = ()
+    
+    _RAWTYPE = bytes
+    
+    def __init__(self, data = None, engine = PyMAKDat.ENGINE_LIST):
+        if isinstance(data, (list, bytearray, memoryview)):
+            data = bytes(data)
+        super().__init__(data, engine)
+    
+    def _calc_raw_timing(self, tracknum):
+        '''Calculate the interval between ticks for a single track and pack them into an array'''
+        return PyMAKDatCompact._pack_timing(super()._calc_raw_timing(tracknum))
+    
+    @staticmethod
+    def _pack_timing(tracktiming):
+        '''Store timing values in the smallest unsigned array type that holds them'''
+        typecode = "H" if len(tracktiming) == 0 or max(tracktiming) <= 0xFFFF else "I"
+        return array.array(typecode, tracktiming)
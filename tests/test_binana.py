@@ -0,0 +1,91 @@
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+REPODIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATADIR = os.path.join(REPODIR, "woodlands_bulk")
+
+def run_binana(*args):
+    proc = subprocess.run([sys.executable, os.path.join(REPODIR, "binana.py")] + list(args), capture_output = True, text = True)
+    return proc.returncode, proc.stdout
+
+@pytest.fixture(scope = "module")
+def shifted(tmp_path_factory):
+    '''Lines of varying length with the P1 sentinel at varying offsets, and a CSV with a field to filter on'''
+    random.seed(1)
+    tmpdir = tmp_path_factory.mktemp("binana")
+    lines = []
+    for curline in range(60):
+        payload = "".join(random.choice("01") for x in range(random.randint(20, 40)))
+        lines += ["0" * random.randint(0, 12) + "11111110" + payload]
+    lines += ["0" * 16]
+    datname = tmpdir / "data.txt"
+    datname.write_text("\n".join(lines) + "\n")
+    extname = tmpdir / "ext.csv"
+    extname.write_text("K,N\n" + "".join("ab"[x % 3 == 0] + "," + str(x) + "\n" for x in range(len(lines))))
+    return str(datname), str(extname)
+
+OPTIONS = [[], ["-d"], ["-p"], ["-ap", "11111110"], ["-ap", "0110"], ["-as", "3"], ["-ae", "2"], ["-re", "4"], ["-rs", "3"],
+           ["-rs", "3", "-re", "3"], ["-re", "500"], ["-rs", "500"], ["-rs", "30", "-re", "30"], ["-ia"], ["-p", "-ia", "-as", "2"], ["-s", "8", "-r"]]
+
+@pytest.mark.parametrize("options", OPTIONS, ids = [ " ".join(x) or "default" for x in OPTIONS ])
+@pytest.mark.parametrize("filtered", [False, True], ids = ["all", "filtered"])
+def test_out_of_core_matches_in_memory(shifted, options, filtered):
+    datname, extname = shifted
+    args = ["-f", datname] + options + (["-e", extname, "-ef", "K", "a"] if filtered else [])
+    inmem = run_binana(*args)
+    assert inmem[0] == 0
+    assert run_binana(*(args + ["-oc"])) == inmem
+
+def test_out_of_core_matches_in_memory_woodlands():
+    args = ["-f", os.path.join(DATADIR, "woodlands_data.txt"), "-e", os.path.join(DATADIR, "woodlands_ext.txt"), "-ef", "P", "25"]
+    inmem = run_binana(*args)
+    assert inmem[0] == 0
+    assert run_binana(*(args + ["-oc"])) == inmem
+
+@pytest.mark.parametrize("field, value, returncode", [("FHOUR", "09", 0), ("FHOUR", "9", 9), ("F", "08", 0), ("PRICE", "3.00", 9)])
+def test_extended_filter_matches_text(field, value, returncode):
+    '''-ef compares the CSV text exactly in both modes, a leading zero or another spelling of a number does not match'''
+    args = ["-f", os.path.join(DATADIR, "woodlands_data.txt"), "-e", os.path.join(DATADIR, "woodlands_ext.txt"), "-ef", field, value, "-nc"]
+    inmem = run_binana(*args)
+    assert inmem[0] == returncode
+    assert run_binana(*(args + ["-oc"])) == inmem
+
+def test_extended_query_compares_numbers():
+    args = ["-f", os.path.join(DATADIR, "woodlands_data.txt"), "-e", os.path.join(DATADIR, "woodlands_ext.txt"), "-nc"]
+    assert run_binana(*(args + ["-eq", "FHOUR==9"])) == run_binana(*(args + ["-ef", "FHOUR", "09"]))
+
+def test_filtered_lines_are_validated(tmp_path):
+    datname = tmp_path / "data.txt"
+    datname.write_text("0011\n01x1\n")
+    extname = tmp_path / "ext.csv"
+    extname.write_text("K\na\nb\n")
+    for extra in ([], ["-oc"]):
+        assert run_binana("-f", str(datname), "-e", str(extname), "-ef", "K", "a", *extra) == (0, "Invalid character in input file\n")
+
+@pytest.mark.parametrize("options, expected", [
+    ([], "0001011000000\n0000000000000\n0001100000000\n"),
+    (["-rs", "3", "-re", "3"], "1011000\n0000000\n1100000\n"),
+    (["-re", "500"], "\n\n\n"),
+    (["-rs", "500"], "\n\n\n"),
+])
+def test_alignment_matches_baseline(tmp_path, options, expected):
+    '''A line without the anchor goes one bit past the furthest anchor and trimming past the end leaves empty lines'''
+    datname = tmp_path / "data.txt"
+    datname.write_text("0001011\n000000000\n1100\n")
+    for extra in ([], ["-oc"]):
+        assert run_binana("-f", str(datname), "-nc", *(options + extra)) == (0, expected)
+
+@pytest.mark.parametrize("option", ["-ax", "-re", "-as"])
+def test_negative_counts_rejected(tmp_path, option):
+    datname = tmp_path / "data.txt"
+    datname.write_text("0011\n0101\n")
+    assert run_binana("-f", str(datname), option, "-2")[0] == 18
+
+def test_checksum_relation_printed_once():
+    returncode, output = run_binana("-f", os.path.join(DATADIR, "woodlands_data.txt"), "-s", "8", "-r", "-xs", "-nc")
+    assert returncode == 0
+    assert [ x for x in output.splitlines() if x.startswith("Token") ] == ["Token 2 (=22) = xor 3,4,5,6,7,10,11 init 0xcb"]
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+REPODIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATADIR = os.path.join(REPODIR, "woodlands_bulk")
+sys.path.insert(0, REPODIR)
+
+import binstat
+
+def symbol_matrix(symbits, symcount, rows = 200):
+    '''Random bits whose chance of being set depends on the position within a symbol, like the high bits of BCD digits'''
+    rng = numpy.random.default_rng(0)
+    probs = numpy.tile(numpy.linspace(0.05, 0.5, symbits), symcount)
+    return (rng.random((rows, symbits * symcount)) < probs).astype(numpy.uint8)
+
+@pytest.mark.parametrize("symbits", [3, 4, 5, 7, 8, 16])
+def test_symbol_period_finds_the_period_not_a_multiple(symbits):
+    period = binstat.symbol_period(binstat.bit_entropy(symbol_matrix(symbits, 120 // symbits)))
+    assert period is not None and period[0] == symbits
+
+def test_symbol_period_ignores_random_bits():
+    bitmat = (numpy.random.default_rng(1).random((200, 120)) < 0.5).astype(numpy.uint8)
+    assert binstat.symbol_period(binstat.bit_entropy(bitmat)) is None
+
+def test_symbol_period_ignores_the_trend_of_p1_data():
+    with open(os.path.join(DATADIR, "woodlands_data.txt")) as fileh:
+        bitmat = numpy.array([ [ int(x) for x in y.strip() ] for y in fileh if y.strip() ], dtype = numpy.uint8)
+    assert binstat.symbol_period(binstat.bit_entropy(bitmat)) is None
+
+def test_symbol_period_constant_profile():
+    assert binstat.symbol_period(numpy.zeros(40)) is None
@@ -0,0 +1,185 @@
+import os
+import argparse
+import shutil
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+REPODIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATADIR = os.path.join(REPODIR, "woodlands_bulk")
+sys.path.insert(0, REPODIR)
+
+import pymakcli
+import pymakdaemon
+import pymakfake
+import pymakint
+
+MALFORMED = bytes([0, 0, 0, 0x40])
+TRACK2 = pymakint.PyMAKInt.TRACK2
+
+def mag_file(num):
+    return os.path.join(DATADIR, "woodlands_bulk-{:03d}.mag".format(num))
+
+def run_cli(*args, **kwargs):
+    env = dict(os.environ, PYTHONUNBUFFERED = "1")
+    return subprocess.Popen([sys.executable, os.path.join(REPODIR, "pymakcli.py")] + list(args), stdout = subprocess.PIPE,
+                            stderr = subprocess.STDOUT, text = True, env = env, **kwargs)
+
+def read_until(proc, count, marker):
+    '''Read CLI output lines until count lines hold marker'''
+    lines = []
+    while len([ x for x in lines if marker in x ]) < count:
+        curline = proc.stdout.readline()
+        assert curline, "".join(lines)
+        lines += [curline]
+    return lines
+
+def woodlands_line(num):
+    with open(os.path.join(DATADIR, "woodlands_data.txt")) as fileh:
+        return fileh.readlines()[num - 1].strip()
+
+def test_async_reads_cards_in_order():
+    cards = [ mag_file(x) for x in (1, 2, 3) ]
+    with pymakfake.FakeMSUSB(cards, swipedelay = 0.01) as fake:
+        with pymakint.AsyncPyMAKInt(pymakint.PyMAKInt(port = fake.get_port()), timeout = 1) as capture:
+            for curfile in cards:
+                assert next(capture).get_raw_data() == pymakint.PyMAKDat(curfile).get_raw_data()
+
+def test_async_malformed_frame_raises_then_stops():
+    with pymakfake.FakeMSUSB([mag_file(1), MALFORMED, mag_file(2)], swipedelay = 0.01) as fake:
+        with pymakint.AsyncPyMAKInt(pymakint.PyMAKInt(port = fake.get_port()), timeout = 1) as capture:
+            assert next(capture).get_raw_data() == pymakint.PyMAKDat(mag_file(1)).get_raw_data()
+            with pytest.raises(ValueError):
+                next(capture)
+            with pytest.raises(StopIteration):
+                next(capture)
+            #The sentinel stays queued for further reads
+            with pytest.raises(StopIteration):
+                next(capture)
+
+def test_async_close_cancels_pending_read():
+    with pymakfake.FakeMSUSB([], swipedelay = 0.01) as fake:
+        capture = pymakint.AsyncPyMAKInt(pymakint.PyMAKInt(port = fake.get_port()), timeout = 30)
+        time.sleep(0.1)
+        starttime = time.monotonic()
+        capture.close()
+        assert time.monotonic() - starttime < 5
+        with pytest.raises(StopIteration):
+            next(capture)
+
+def test_pool_keeps_reading_after_a_reader_fails():
+    with pymakfake.FakeMSUSB([MALFORMED], swipedelay = 0.01) as badfake, pymakfake.FakeMSUSB([mag_file(1), mag_file(2)], swipedelay = 0.2) as goodfake:
+        with pymakint.PyMAKIntPool([badfake.get_port(), goodfake.get_port()], timeout = 1) as pool:
+            items = []
+            for port, item in pool:
+                items += [(port, item)]
+                if len(items) == 3:
+                    pool.close()
+    assert [ x for x, y in items if isinstance(y, ValueError) ] == [badfake.get_port()]
+    assert [ y.get_raw_data() for x, y in items if x == goodfake.get_port() ] == \
+           [ pymakint.PyMAKDat(mag_file(x)).get_raw_data() for x in (1, 2) ]
+
+def test_pool_ends_when_all_readers_stop():
+    with pymakfake.FakeMSUSB([mag_file(1)], swipedelay = 0.01) as fake1, pymakfake.FakeMSUSB([], swipedelay = 0.01) as fake2:
+        with pymakint.PyMAKIntPool([fake1.get_port(), fake2.get_port()], timeout = 1) as pool:
+            assert next(pool)[0] == fake1.get_port()
+            pool.close()
+            with pytest.raises(StopIteration):
+                next(pool)
+
+def test_daemon_persists_in_batches():
+    batches = []
+    daemon = pymakdaemon.CaptureDaemon(iter(range(10)), batches.append, batchsize = 4, flushinterval = 0.01)
+    daemon.run()
+    assert sum(batches, []) == list(range(10))
+    assert daemon.get_error() is None
+    assert daemon.get_stats()["written"] == 10
+
+def test_daemon_persist_failure_stops_writer():
+    errors = []
+    def persist(batch):
+        raise OSError("disk full")
+    def source():
+        for curframe in range(100):
+            time.sleep(0.01)
+            yield curframe
+    daemon = pymakdaemon.CaptureDaemon(source(), persist, batchsize = 1, flushinterval = 0.01, onerror = errors.append)
+    daemon.run()
+    stats = daemon.get_stats()
+    assert isinstance(daemon.get_error(), OSError)
+    assert errors == [daemon.get_error()]
+    assert stats["failed"] == 1 and stats["written"] == 0
+    assert stats["captured"] < 100
+
+def test_persist_batch_syncs_once_per_batch(tmp_path, monkeypatch):
+    ags = argparse.Namespace(save = str(tmp_path / "cap"), data = None, extended = None, track = TRACK2)
+    monkeypatch.setattr(pymakcli.save_data, "archive", None)
+    monkeypatch.setattr(pymakcli.save_data, "savecount", {None: 1}, raising = False)
+    calls = {"fsync": 0, "replace": 0}
+    def counted(name, func):
+        def wrapper(*args):
+            calls[name] += 1
+            return func(*args)
+        return wrapper
+    monkeypatch.setattr(os, "fsync", counted("fsync", os.fsync))
+    monkeypatch.setattr(os, "replace", counted("replace", os.replace))
+    cards = [ pymakint.PyMAKDat(mag_file(x)) for x in (1, 3, 4, 5) ]
+    pymakcli.persist_batch(ags, [ (None, x) for x in cards ], None, None, None)
+    #One rename per capture and the counter, one sync per capture, the counter and the directory
+    assert calls == {"fsync": len(cards) + 2, "replace": len(cards) + 1}
+    assert (tmp_path / "cap.count").read_text() == "5\n"
+    for curnum, curcard in enumerate(cards, 1):
+        assert (tmp_path / "cap-{:03d}.mag".format(curnum)).read_bytes() == curcard.get_mag_data()
+
+def test_cli_daemon_exits_on_persist_failure(tmp_path):
+    savedir = tmp_path / "saves"
+    savedir.mkdir()
+    with pymakfake.FakeMSUSB([mag_file(1), mag_file(2)], swipedelay = 1) as fake:
+        proc = run_cli("-r", "-D", "-s", str(savedir / "cap"), "-p", fake.get_port())
+        assert proc.stdout.readline().startswith("Capturing cards")
+        shutil.rmtree(savedir)
+        output = proc.communicate(timeout = 30)[0]
+    assert proc.returncode == 30
+    assert "failed: 1" in output
+    assert "Error: persisting captures failed" in output
+
+@pytest.mark.parametrize("decoder", ["P1V", "F2FRAW"])
+def test_cli_write_and_verify(tmp_path, decoder):
+    datname = tmp_path / "data.txt"
+    if decoder == "F2FRAW":
+        datname.write_text("".join("0" * 20 + format(x * 37, "b") + "0" * 20 + "\n" for x in range(1, 6)))
+    else:
+        with open(os.path.join(DATADIR, "woodlands_data.txt")) as fileh:
+            datname.write_text("".join(fileh.readlines()[:5]))
+    cards = len(datname.read_text().splitlines())
+    with pymakfake.FakeMSUSB([], swipedelay = 0.01) as fake:
+        proc = run_cli("-w", "-ed", decoder, "-d", str(datname), "-v", "-p", fake.get_port())
+        output = proc.communicate(timeout = 60)[0]
+    assert proc.returncode == 0
+    assert output.count("Verified") == cards
+    assert "Written {} cards, 0 failed".format(cards) in output
+
+@pytest.mark.parametrize("daemon", [False, True], ids = ["serial", "daemon"])
+def test_cli_pool_keeps_reading_after_a_malformed_frame(tmp_path, daemon):
+    datname = tmp_path / "data.txt"
+    with pymakfake.FakeMSUSB([MALFORMED], swipedelay = 0.01) as badfake, pymakfake.FakeMSUSB([mag_file(1), mag_file(3), mag_file(4)], swipedelay = 0.3) as goodfake:
+        proc = run_cli("-r", "-ed", "P1V", "-d", str(datname), "-p", badfake.get_port() + "," + goodfake.get_port(), *(["-D"] if daemon else []))
+        #A card is saved after its decode is printed, the third decode shows the first two are saved
+        lines = read_until(proc, 3, goodfake.get_port() + ": ")
+        proc.send_signal(signal.SIGINT)
+        output = "".join(lines) + proc.communicate(timeout = 30)[0]
+    assert proc.returncode == 0
+    assert badfake.get_port() + ": Error parsing tick transition" in output
+    assert datname.read_text().splitlines()[:2] == [woodlands_line(1), woodlands_line(3)]
+
+def test_cli_single_reader_reports_a_malformed_frame(tmp_path):
+    datname = tmp_path / "data.txt"
+    with pymakfake.FakeMSUSB([mag_file(1), MALFORMED], swipedelay = 0.01) as fake:
+        proc = run_cli("-r", "-ed", "P1V", "-d", str(datname), "-p", fake.get_port())
+        output = proc.communicate(timeout = 30)[0]
+    assert proc.returncode == 0
+    assert "Error parsing tick transition" in output and "Traceback" not in output
+    assert datname.read_text().splitlines() == [woodlands_line(1)]
@@ -0,0 +1,48 @@
+import glob
+import os
+import sys
+
+import pytest
+
+REPODIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATADIR = os.path.join(REPODIR, "woodlands_bulk")
+sys.path.insert(0, REPODIR)
+
+import pymagpar
+import pymakint
+
+TRACK2 = pymakint.PyMAKInt.TRACK2
+
+def woodlands_lines():
+    with open(os.path.join(DATADIR, "woodlands_data.txt")) as fileh:
+        return [ x.strip() for x in fileh if x.strip() ]
+
+def test_p1v_adaptive_decodes_every_woodlands_capture():
+    magfiles = sorted(glob.glob(os.path.join(DATADIR, "woodlands_bulk-*.mag")))
+    assert [ pymagpar.p1v_adaptive_decode(pymakint.PyMAKDat(x), TRACK2) for x in magfiles ] == woodlands_lines()
+
+@pytest.mark.parametrize("num", [32, 137])
+def test_p1v_adaptive_falls_back_to_backward_swipe(num):
+    cdat = pymakint.PyMAKDat(os.path.join(DATADIR, "woodlands_bulk-{:03d}.mag".format(num)))
+    with pytest.raises(TypeError):
+        pymagpar.p1v_check(pymagpar.f2f_bits_adaptive(cdat.get_raw_track_timing(TRACK2)))
+    assert pymagpar.p1v_adaptive_decode(cdat, TRACK2) == woodlands_lines()[num - 1]
+
+def test_f2f_bits_both_decodes_reversed_on_demand():
+    bits = "0" * 10 + "1101001110001" + "0" * 4
+    tvalues = pymagpar.f2f_encode_bits(bits)
+    decoded = []
+    def decode_func(curvalues):
+        decoded.append(curvalues)
+        return pymagpar.f2f_bits(curvalues)
+    both = pymagpar.f2f_bits_both(tvalues, decode_func)
+    backward, rbits = next(both)
+    assert not backward and str(rbits) in bits
+    assert decoded == [tvalues]
+    backward, rbits = next(both)
+    assert backward and decoded == [tvalues, tvalues[::-1]]
+
+def test_f2f_bits_both_reports_failed_direction():
+    tvalues = [200] * 20 + [1000] + [200] * 20
+    assert [ x for x, y in pymagpar.f2f_bits_both(tvalues, pymagpar.f2f_bits) ] == [False, True]
+    assert [ y for x, y in pymagpar.f2f_bits_both(tvalues, pymagpar.f2f_bits) ] == [None, None]
@@ -0,0 +1,70 @@
+import os
+import sys
+
+import pytest
+
+REPODIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATADIR = os.path.join(REPODIR, "woodlands_bulk")
+sys.path.insert(0, REPODIR)
+
+import pymagpar
+import pymakint
+
+TRACK2 = pymakint.PyMAKInt.TRACK2
+
+def woodlands_lines():
+    with open(os.path.join(DATADIR, "woodlands_data.txt")) as fileh:
+        return [ x.strip() for x in fileh if x.strip() ]
+
+def encoded(encode_func, str_rep, track = TRACK2):
+    cdat = pymakint.PyMAKDat()
+    encode_func(cdat, track, str_rep)
+    #Go through the raw tick data the way a written card would be read back
+    return pymakint.PyMAKDat(cdat.get_raw_data())
+
+def test_p1v_round_trip():
+    lines = woodlands_lines()
+    assert len(lines) == 141
+    for curline in lines:
+        assert pymagpar.p1v_decode(encoded(pymagpar.p1v_encode, curline), TRACK2) == curline
+
+def test_p1v_round_trip_adaptive():
+    curline = woodlands_lines()[0]
+    assert pymagpar.p1v_adaptive_decode(encoded(pymagpar.p1v_encode, curline), TRACK2) == curline
+
+@pytest.mark.parametrize("bits", ["0" * 10 + "1", "0" * 12 + "1101001110001", "0" * 10 + "1" * 40 + "0" * 5])
+def test_f2f_raw_round_trip(bits):
+    assert pymagpar.f2f_raw_decode(encoded(pymagpar.f2f_raw_encode, bits), TRACK2).rstrip("0") == bits.rstrip("0")
+
+#Tracks with fewer than 10 transitions read as empty
+@pytest.mark.parametrize("values", ["100 200 300 " * 4, "511 512 1500 7 1 " * 2, "1 " * 10])
+def test_raw_round_trip(values):
+    assert pymagpar.raw_decode(encoded(pymagpar.raw_encode, values), TRACK2).split() == values.split()
+
+def test_encoding_keeps_other_tracks():
+    cdat = pymakint.PyMAKDat()
+    timing = {pymakint.PyMAKInt.TRACK1: [150, 75, 75] * 10, pymakint.PyMAKInt.TRACK3: [600, 333] * 8}
+    for track, tracktiming in timing.items():
+        cdat.set_raw_track_timing(track, tracktiming)
+    pymagpar.p1v_encode(cdat, TRACK2, woodlands_lines()[0])
+    cdat = pymakint.PyMAKDat(cdat.get_raw_data())
+    assert pymagpar.p1v_decode(cdat, TRACK2) == woodlands_lines()[0]
+    for track, tracktiming in timing.items():
+        assert cdat.get_raw_track_timing(track) == tracktiming
+
+@pytest.mark.parametrize("encode_func, str_rep", [
+    (pymagpar.p1v_encode, "0101"),
+    (pymagpar.p1v_encode, "2" * 200),
+    (pymagpar.p1v_encode, "0" * 200),
+    (pymagpar.f2f_raw_encode, "0" * 10 + "012"),
+    (pymagpar.f2f_raw_encode, "1" + "0" * 10),
+    (pymagpar.raw_encode, "100 abc"),
+])
+def test_invalid_data_rejected(encode_func, str_rep):
+    with pytest.raises(TypeError):
+        encode_func(pymakint.PyMAKDat(), TRACK2, str_rep)
+
+@pytest.mark.parametrize("track, values", [(TRACK2, [100, 0, 100]), (TRACK2, [100, -5]), (3, [100]), (8, [100])])
+def test_invalid_timing_rejected(track, values):
+    with pytest.raises(ValueError):
+        pymakint.PyMAKDat().set_raw_track_timing(track, values)